@@ -6,10 +6,24 @@ using torque, grid, or locally with xargs.
 from __future__ import print_function
 from __future__ import absolute_import
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import errno
+import fcntl
+import functools
+import io
+import itertools
 import os
-import psutil
+import queue
+import re
+import selectors
+import shlex
+import shutil
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 
 # Determine how to decode bytes
@@ -19,13 +33,1016 @@ if std_encoding is None:
 if std_encoding is None:
     std_encoding = "utf-8"
 
+# Local jobs are started with the absolute path of bash and without closing the inherited file
+# descriptors, which lets subprocess use posix_spawn instead of fork + exec.  This avoids copying
+# the page tables of a large parent process for every job.  The file descriptors opened by
+# python are not inheritable, so there is nothing to close.
+_BASH = shutil.which("bash") or "/bin/bash"
+
+
+def _decode_bytes(b):
+    """Decode the stdout of a subprocess, which is bytes, into str."""
+    return b.decode(std_encoding, "replace")
+
+
+# Environment variables controlling the size of the thread pools of numerical libraries
+_MATH_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Array job parameter placeholders {1} through {9}
+_PLACEHOLDER_RE = re.compile(r"\{([1-9])\}")
+
+# Characters with a special meaning to the shell.  Command lines containing any of them are executed by bash.
+_SHELL_META_RE = re.compile(r"""[|&;<>()$`\\"'*?\[\]~{}#!\n]""")
+
+# All the bash builtins and keywords, as listed by compgen -b and compgen -k.  Many of them are also
+# installed as executables, such as /usr/bin/echo, /usr/bin/pwd, or /usr/bin/time, which do not behave
+# like the builtin, so commands starting with any of them always run in bash.
+_SHELL_BUILTINS = frozenset((
+    ".", ":", "[", "alias", "bg", "bind", "break", "builtin", "caller", "cd", "command", "compgen",
+    "complete", "compopt", "continue", "declare", "dirs", "disown", "echo", "enable", "eval", "exec",
+    "exit", "export", "false", "fc", "fg", "getopts", "hash", "help", "history", "jobs", "kill", "let",
+    "local", "logout", "mapfile", "popd", "printf", "pushd", "pwd", "read", "readarray", "readonly",
+    "return", "set", "shift", "shopt", "source", "suspend", "test", "times", "trap", "true", "type",
+    "typeset", "ulimit", "umask", "unalias", "unset", "wait",
+    "if", "then", "else", "elif", "fi", "case", "esac", "for", "select", "while", "until", "do", "done",
+    "in", "function", "time", "{", "}", "!", "[[", "]]", "coproc"))
+
+# Characters of array job parameters which bash would split or expand after substitution
+_SPLIT_OR_GLOB_RE = re.compile(r"[\s*?\[]")
+
+
+def _usable_cpus():
+    """Return the number of CPU cores the current process is allowed to use.
+
+    On Linux, this honors the CPU affinity imposed by taskset, cgroups, or an enclosing HPC job
+    allocation.  Elsewhere, it is the total number of CPU cores.
+
+    Examples
+    --------
+    >>> _usable_cpus() >= 1
+    True
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _count_lines(path):
+    """Count the lines in a non-empty file, including a last line without a trailing newline.
+
+    The file is read in large binary blocks and the newlines are counted in C rather than
+    iterating over the lines in Python.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+
+    Returns
+    -------
+    num_lines : int
+        Number of lines in the file.
+
+    Examples
+    --------
+    >>> from tempfile import NamedTemporaryFile
+    >>> fout = NamedTemporaryFile(delete=False, mode='w'); _ = fout.write("a\\nb\\nc"); fout.close()
+    >>> _count_lines(fout.name)
+    3
+    >>> fout = open(fout.name, 'a'); _ = fout.write("\\n"); fout.close()
+    >>> _count_lines(fout.name)
+    3
+    >>> os.unlink(fout.name)
+    """
+    num_lines = 0
+    last_block = b''
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            num_lines += block.count(b'\n')
+            last_block = block
+    if last_block[-1:] != b'\n':
+        num_lines += 1  # last line without a newline
+    return num_lines
+
+
+@functools.lru_cache(maxsize=1024)
+def _split_array_line(line):
+    """Split a line of an array file into parameters, honoring quotes and backslashes like xargs.
+
+    The result is cached because parameter sweeps often repeat the same lines.
+
+    Examples
+    --------
+    >>> _split_array_line("a 'b c' d\\n")
+    ('a', 'b c', 'd')
+    """
+    return tuple(shlex.split(line))
+
+
+_ARGUMENT_RE = re.compile(r"\{([0-9]+)\}")
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_template(template, placeholder_re):
+    """Split a template into its literal text and parameter numbers, once for all the array file lines.
+
+    Parameters
+    ----------
+    template : str
+        Text with parameter placeholders.
+    placeholder_re : re.Pattern
+        Regular expression matching a placeholder, capturing the parameter number.
+
+    Returns
+    -------
+    parts : tuple
+        Literal strings at even indexes, alternating with parameter numbers at odd indexes.
+
+    Examples
+    --------
+    >>> _compile_template("cmd {1} x{2}y", _PLACEHOLDER_RE)
+    ('cmd ', 1, ' x', 2, 'y')
+    """
+    parts = placeholder_re.split(template)
+    parts[1::2] = [int(param_num) for param_num in parts[1::2]]
+    return tuple(parts)
+
+
+def _render_template(parts, params):
+    """Substitute parameters into a template compiled by _compile_template().  Missing parameters are replaced by nothing."""
+    text = [parts[0]]
+    for i in range(1, len(parts), 2):
+        param_num = parts[i]
+        if 0 < param_num <= len(params):
+            text.append(params[param_num - 1])
+        text.append(parts[i + 1])
+    return ''.join(text)
+
+
+def _substitute_arguments(command_line, arguments):
+    """Replace the parameter placeholders in a command line with the arguments of an array file line.
+
+    The substitution is the same as qarrayrun performs on the compute node: {1} is replaced
+    by the first argument, and placeholders without a corresponding argument are removed.
+
+    Examples
+    --------
+    >>> _substitute_arguments("cmd {0}/{1}/{2} -- {3}{4}", ["aa", "bb", "cc"])
+    'cmd /aa/bb -- cc'
+    """
+    return _render_template(_compile_template(command_line, _ARGUMENT_RE), arguments)
+
+
+# Size of the chunks copied from a job to stdout and of the log file buffer
+_TEE_BUFFER_SIZE = 1 << 16
+
+# Maximum delay, in seconds, before buffered output of a running job is written to its log file or stdout
+_TEE_FLUSH_INTERVAL = 0.2
+
+
+class _StdoutBuffer(object):
+    """Collects the output of local jobs copied to stdout, to write it in blocks of up to 64 KB.
+
+    A single buffer is shared by all the tee threads of the process, so the short writes of
+    many concurrent array tasks are combined into few write calls.  The buffer is flushed by a
+    timer at most 0.2 seconds after the first write into an empty buffer, and when a job exits.
+    """
+    def __init__(self):
+        self.writer = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            if self.writer is None:
+                self.writer = io.BufferedWriter(io.FileIO(1, 'wb', closefd=False), buffer_size=_TEE_BUFFER_SIZE)
+            self.writer.write(data)
+            if self.timer is None:
+                self.timer = threading.Timer(_TEE_FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.writer is not None:
+                self.writer.flush()
+
+
+_stdout_buffer = _StdoutBuffer()
+
+
+# Log files are truncated like tee does, and never inherited by the other jobs started while they are written
+_LOG_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
+
+
+def _open_log(log_file):
+    """Open a log file for writing through a 64 KB buffer."""
+    fd = os.open(log_file, _LOG_FLAGS, 0o666)
+    return os.fdopen(fd, "wb", buffering=_TEE_BUFFER_SIZE)
+
+
+# On Linux, the tee moves the output of a job from its pipe to the log file with splice, then copies
+# it from the log file to stdout with sendfile, without ever reading the output into python
+_USE_SPLICE = hasattr(os, "splice") and hasattr(os, "sendfile")
+
+
+def _log_open_failed(log_file, error):
+    """Report a log file which cannot be opened like bash reports a failed redirection, and return exit status 1.
+
+    The command of the job is not started.  The exit status makes the job fail with a
+    CalledProcessError, which is routed to the exception handler like any other job failure.
+    """
+    sys.stderr.write("jobrunner: %s: %s\n" % (log_file, error.strerror))
+    return 1
+
+
+def _run_to_log(args, log_file, stdin=None):
+    """Run a command with stdout and stderr redirected to a log file.
+
+    The log file is passed to the command as its stdout, so the output goes to the file without
+    passing through this process.
+
+    Parameters
+    ----------
+    args : list of str
+        Command and arguments to execute.
+    log_file : str
+        Path to the log file.  When empty, None, or os.devnull, the output is discarded without
+        opening a file.
+    stdin : int, optional, defaults to None
+        Standard input of the command, as accepted by subprocess.  By default, it is inherited.
+
+    Returns
+    -------
+    return_code : int
+        Exit status of the command, or 1 when the log file cannot be opened.
+    """
+    if not log_file or log_file == os.devnull:
+        return subprocess.call(args, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, close_fds=False)
+    try:
+        fd = os.open(log_file, _LOG_FLAGS, 0o666)
+    except OSError as e:
+        return _log_open_failed(log_file, e)
+    try:
+        return subprocess.call(args, stdin=stdin, stdout=fd, stderr=subprocess.STDOUT, close_fds=False)
+    finally:
+        os.close(fd)
+
+
+def _run_tee(args, log_file, stdin=None):
+    """Run a command with stderr joined to stdout, copying its output to stdout and to a log file.
+
+    The output is moved from the pipe in chunks of up to 64 KB, rather than line by line, whenever
+    the selector reports it is readable.  On Linux, the chunks are moved to the log file by the
+    kernel with splice, and copied from the log file to stdout with sendfile.  Elsewhere, or without
+    a log file, the chunks are read with os.read and the log file is written through a 64 KB buffer,
+    flushed at most 0.2 seconds after new output arrives, even when the command then stays silent,
+    and when the command exits.
+
+    Stdout is written in blocks through a buffer shared by all the jobs, flushed at least every
+    0.2 seconds and when the command exits, or with sendfile when possible.  The chunks are copied
+    to stdout as they are, except when stdout is a terminal.  Then, only
+    complete lines are written, so the lines of concurrent array tasks are not mixed together on
+    the screen.  A partial line is written when the command stays silent for 0.2 seconds.
+
+    Parameters
+    ----------
+    args : list of str
+        Command and arguments to execute.
+    log_file : str
+        Path to the log file.  When empty, the output is only copied to stdout.
+    stdin : int, optional, defaults to None
+        Standard input of the command, as accepted by subprocess.  By default, it is inherited.
+
+    Returns
+    -------
+    return_code : int
+        Exit status of the command, or 1 when the log file cannot be opened.
+
+    Examples
+    --------
+    >>> from tempfile import NamedTemporaryFile
+    >>> fout = NamedTemporaryFile(delete=False); fout.close()
+    >>> _run_tee([_BASH, "-c", "echo text to stderr 1>&2; exit 3"], fout.name)
+    3
+    >>> f = open(fout.name); out = f.read(); f.close(); os.unlink(fout.name)
+    >>> print(out.strip())
+    text to stderr
+    """
+    pump = _pump_read
+    try:
+        if log_file and _USE_SPLICE:
+            log = os.open(log_file, (_LOG_FLAGS & ~os.O_WRONLY) | os.O_RDWR, 0o666)  # read back by sendfile
+            if stat.S_ISREG(os.fstat(log).st_mode):
+                pump = _pump_splice
+            else:
+                log = os.fdopen(log, "wb", buffering=_TEE_BUFFER_SIZE)  # a device or a pipe cannot be read back
+        else:
+            log = _open_log(log_file) if log_file else None
+    except OSError as e:
+        return _log_open_failed(log_file, e)
+    try:
+        process = subprocess.Popen(args, bufsize=0, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=False)
+        fd = process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)  # os.set_blocking() needs python 3.5
+        with process.stdout, selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            pump(fd, log, selector, os.isatty(1))
+    finally:
+        _stdout_buffer.flush()
+        if pump is _pump_splice:
+            os.close(log)
+        elif log:
+            log.close()
+    return process.wait()
+
+
+def _pump_read(fd, log, selector, whole_lines):
+    """Copy the output of a job from its pipe to stdout and to a buffered log file, until the end of the output.
+
+    When whole_lines is true, the end of an incomplete line is held back from stdout until the rest
+    of the line arrives, or until the job stays silent for 0.2 seconds.
+    """
+    last_flush = time.monotonic()
+    unflushed = False
+    partial_line = b""
+    while True:
+        if not selector.select(_TEE_FLUSH_INTERVAL if unflushed or partial_line else None):
+            # The command is quiet, write what it printed so far
+            if partial_line:
+                _stdout_buffer.write(partial_line)
+                partial_line = b""
+            if unflushed:
+                log.flush()
+                last_flush = time.monotonic()
+                unflushed = False
+            continue
+        try:
+            data = os.read(fd, _TEE_BUFFER_SIZE)
+        except BlockingIOError:
+            continue
+        if not data:
+            break
+        if whole_lines:
+            lines = partial_line + data
+            end = lines.rfind(b"\n") + 1
+            partial_line = lines[end:]
+            if end:
+                _stdout_buffer.write(lines[:end])
+        else:
+            _stdout_buffer.write(data)
+        if log:
+            log.write(data)
+            unflushed = True
+            now = time.monotonic()
+            if now - last_flush >= _TEE_FLUSH_INTERVAL:
+                log.flush()
+                last_flush = now
+                unflushed = False
+    if partial_line:
+        _stdout_buffer.write(partial_line)
+
+
+def _pump_splice(fd, log_fd, selector, whole_lines):
+    """Move the output of a job from its pipe to a log file with splice, and copy it to stdout with sendfile.
+
+    The log file descriptor must be a regular file open for reading and writing.  When stdout does
+    not support sendfile, for example when it was opened in append mode, the bytes are copied with
+    os.pread.  When the file system of the log file does not support splice, the rest of the output
+    is copied by _pump_read().
+    When whole_lines is true, the end of an incomplete line is held back from stdout until the rest
+    of the line arrives, or until the job stays silent for 0.2 seconds.
+    """
+    written = 0  # bytes moved to the log file
+    copied = 0  # bytes copied to stdout
+    use_sendfile = not whole_lines
+    while True:
+        if not selector.select(_TEE_FLUSH_INTERVAL if copied < written else None):
+            _copy_to_stdout(log_fd, copied, written, False)  # the command is quiet, write the partial line
+            copied = written
+            continue
+        try:
+            count = os.splice(fd, log_fd, _TEE_BUFFER_SIZE)
+        except BlockingIOError:
+            continue
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            _copy_to_stdout(log_fd, copied, written, False)
+            with os.fdopen(log_fd, "wb", buffering=_TEE_BUFFER_SIZE, closefd=False) as log:
+                _pump_read(fd, log, selector, whole_lines)
+            return
+        if count == 0:
+            break
+        start = written
+        written += count
+        if whole_lines:
+            # Only the new bytes are searched for the end of a line, so a long partial line is read back once
+            data = os.pread(log_fd, count, start)
+            end = data.rfind(b"\n") + 1
+            if end:
+                _copy_to_stdout(log_fd, copied, start, False)  # the beginning of the line
+                _stdout_buffer.write(data[:end])
+                copied = start + end
+        else:
+            use_sendfile = _copy_to_stdout(log_fd, copied, written, use_sendfile)
+            copied = written
+    _copy_to_stdout(log_fd, copied, written, use_sendfile)
+
+
+def _copy_to_stdout(log_fd, start, end, use_sendfile):
+    """Copy a range of bytes of the log file to stdout.
+
+    Returns whether sendfile can be used for the next copy.  It is false once stdout rejected sendfile,
+    or sendfile copied nothing.  The copy stops early if the log file was truncated.
+    """
+    if use_sendfile:
+        _stdout_buffer.flush()  # keep the order of the output written through the buffer
+    while start < end:
+        if use_sendfile:
+            try:
+                count = os.sendfile(1, log_fd, start, end - start)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                count = 0
+            if count:
+                start += count
+            else:
+                use_sendfile = False
+        else:
+            data = os.pread(log_fd, end - start, start)
+            if not data:
+                break
+            _stdout_buffer.write(data)
+            start += len(data)
+    return use_sendfile
+
+
+def _split_plain_command(command_line):
+    """Split a command line without any shell syntax into arguments, to execute it without a shell.
+
+    The array job parameter placeholders {1} through {9} are allowed and left in the arguments.
+    The executable is resolved to its absolute path.
+
+    Parameters
+    ----------
+    command_line : str
+        Command with all arguments.
+
+    Returns
+    -------
+    args : list of str
+        Command arguments, or None when the command line must be executed by bash because it
+        contains shell syntax, or because the command is a shell builtin or keyword.
+
+    Examples
+    --------
+    >>> _split_plain_command("cat Hello {1}")[1:]
+    ['Hello', '{1}']
+    >>> _split_plain_command("echo text to stderr 1>&2") is None
+    True
+    >>> _split_plain_command("exit 100") is None
+    True
+    >>> _split_plain_command("time cat") is None
+    True
+    >>> _split_plain_command("echo --version") is None
+    True
+    """
+    words = command_line.split()
+    if not words or '=' in words[0] or words[0] in _SHELL_BUILTINS or _SHELL_META_RE.search(_PLACEHOLDER_RE.sub("", command_line)):
+        return None
+    executable = shutil.which(words[0])
+    if executable is None:
+        return None  # builtin, keyword, or missing command, let bash handle it
+    return [executable] + words[1:]
+
+
+def _compile_args(words):
+    """Compile the arguments of a command split by _split_plain_command(), once for all the tasks of an array job.
+
+    Returns a list where the arguments without placeholders are kept as strings, and the other
+    arguments are replaced by their template compiled by _compile_template().
+    """
+    return [_compile_template(word, _PLACEHOLDER_RE) if '{' in word else word for word in words]
+
+
+def _substitute_args(arg_templates, params):
+    """Substitute array job parameters into the argument templates compiled by _compile_args().
+
+    Like bash does for an unquoted unset parameter, an argument made only of placeholders without
+    a corresponding parameter is removed.
+
+    Examples
+    --------
+    >>> _substitute_args(_compile_args(["echo", "Hello", "{1}", "{3}", "x{2}"]), ["World", "1"])
+    ['echo', 'Hello', 'World', 'x1']
+    """
+    args = []
+    for arg in arg_templates:
+        if type(arg) is tuple:
+            arg = _render_template(arg, params)
+            if not arg:
+                continue
+        args.append(arg)
+    return args
+
+
+def _run_array_task(task):
+    """Run one task of a local array job in a pool worker thread.
+
+    The argument list is prepared before the task is submitted, so the worker only starts the
+    command and waits for it.
+
+    Parameters
+    ----------
+    task : tuple of (int, list of str, str, bool)
+        Task number, argument list, log file of the task, and quiet flag.  The output is written
+        to the log file, and also copied to stdout unless quiet is true.
+
+    Returns
+    -------
+    task_num : int
+        Task number.
+    return_code : int
+        Exit status of the script.
+    """
+    task_num, args, log_file, quiet = task
+    # Like xargs, the tasks do not share the standard input of this process
+    return task_num, _run_to_log(args, log_file, subprocess.DEVNULL) if quiet else _run_tee(args, log_file, subprocess.DEVNULL)
+
+
+def _run_array_slice(task):
+    """Run a slice of the tasks of a local array job one after another in a single bash process.
+
+    Parameters
+    ----------
+    task : tuple of (str, list of int, list of str, bool)
+        Bash script running the tasks of the slice and printing the task number and exit status
+        of each one, task numbers, log files of the tasks, and quiet flag.  Unless quiet is true,
+        the log files are copied to stdout after the slice completes.
+
+    Returns
+    -------
+    results : list of tuple of (int, int)
+        Task number and exit status of each task.
+    """
+    script, task_nums, log_files, quiet = task
+
+    # The script is run from a file rather than with bash -c, which limits the length of the script
+    fd, script_file = tempfile.mkstemp(prefix="jobrunner-", suffix=".sh")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(script)
+        process = subprocess.Popen([_BASH, script_file], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, close_fds=False)
+        output, _ = process.communicate()
+    finally:
+        os.unlink(script_file)
+
+    # A task without a reported exit status was interrupted along with the script
+    statuses = dict(tuple(int(field) for field in line.split()) for line in output.splitlines())
+    results = [(task_num, statuses.get(task_num, process.returncode)) for task_num in task_nums]
+
+    if not quiet:
+        for log_file in log_files:
+            _copy_log_to_stdout(log_file)
+        _stdout_buffer.flush()
+    return results
+
+
+def _copy_log_to_stdout(log_file):
+    """Copy the whole content of a log file written by a completed task to stdout.
+
+    A log file which cannot be opened is skipped: bash could not create it either, which already
+    failed the task.
+    """
+    try:
+        f = open(log_file, "rb")
+    except OSError:
+        return
+    with f:
+        _copy_to_stdout(f.fileno(), 0, os.fstat(f.fileno()).st_size, _USE_SPLICE)  # sendfile only writes to sockets outside Linux
+
+
+def _sed_dispatch_command(commands_file, subtask_env_var_name):
+    """Create the command of an HPC array sub-task executing its line of a commands file.
+
+    The sub-task extracts its command with sed and evaluates it in sh, instead of starting a
+    qarrayrun Python interpreter.
+
+    Examples
+    --------
+    >>> print(_sed_dispatch_command("/tmp/cmds", "SLURM_ARRAY_TASK_ID"))
+    sh -c 'eval "$(sed -n "${SLURM_ARRAY_TASK_ID}p" "$0")"' /tmp/cmds
+    """
+    return "sh -c " + shlex.quote('eval "$(sed -n "${%s}p" "$0")"' % subtask_env_var_name) + ' ' + shlex.quote(commands_file)
+
 
 class JobRunnerException(Exception):
     """Raised for fatal JobRunner errors"""
 
 
+class _BashCoprocess(object):
+    """A long-lived bash process executing one command line at a time from its standard input.
+
+    Reusing a single shell avoids paying the bash startup cost for every local job.  Each command
+    runs in a subshell so changes to the working directory or environment variables made by one
+    command do not leak into the next.  The exit status of each command is reported on the
+    standard error of the shell, following a newline and a sentinel string.  The newline ends
+    the last line of the command output when it is incomplete, and is removed again.
+    """
+    sentinel = b"__JOBRUNNER_DONE__"
+
+    def __init__(self):
+        self.process = subprocess.Popen([_BASH, "--noprofile", "--norc"], stdin=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=False)
+        self.lock = threading.Lock()
+
+    def run(self, command_line):
+        """Execute a command line and wait for it to complete.
+
+        The command runs in the current working directory with standard input from /dev/null.
+
+        Parameters
+        ----------
+        command_line : str
+            Bash command line to execute.
+
+        Returns
+        -------
+        return_code : int
+            Exit status of the command.
+        """
+        # eval the command so a syntax error fails the command rather than killing the shell
+        script = "( cd %s && eval %s ) < /dev/null; printf '\\n%s%%d\\n' $? >&2\n" % (shlex.quote(os.getcwd()), shlex.quote(command_line), self.sentinel.decode())
+        with self.lock:
+            self.process.stdin.write(script.encode(std_encoding))
+            self.process.stdin.flush()
+            newline = b""  # the newline of the previous line is held back, in case it precedes the sentinel
+            while True:
+                line = self.process.stderr.readline()
+                if not line:
+                    raise JobRunnerException("The reusable bash shell exited unexpectedly.")
+                if line.startswith(self.sentinel):
+                    return int(line[len(self.sentinel):])
+                self._write_stderr(newline + line[:-1])
+                newline = line[-1:]
+
+    def _write_stderr(self, line):
+        """Pass a line of the standard error of the shell through to sys.stderr, as bytes when possible."""
+        stderr = getattr(sys.stderr, "buffer", None)
+        if stderr is None:
+            sys.stderr.write(_decode_bytes(line))  # sys.stderr was replaced by a text-only stream
+        else:
+            sys.stderr.flush()
+            stderr.write(line)
+            stderr.flush()
+
+    def close(self):
+        """Terminate the shell."""
+        self.process.stdin.close()
+        self.process.wait()
+
+
+# Job states reported by JobRunner.poll_status(), from highest to lowest priority when
+# combining the states of the sub-tasks of an array job
+JOB_STATES = ("FAILED", "RUNNING", "PENDING", "COMPLETED", "UNKNOWN")
+
+
+def _combine_states(states):
+    """Combine the states of the sub-tasks of an array job into the state of the whole job.
+
+    Examples
+    --------
+    >>> _combine_states(["COMPLETED", "RUNNING", "PENDING"])
+    'RUNNING'
+    >>> _combine_states(["COMPLETED", "COMPLETED"])
+    'COMPLETED'
+    >>> _combine_states(["FAILED", "RUNNING"])
+    'FAILED'
+    """
+    return min(states, key=JOB_STATES.index)
+
+
+class _QsubBuilder(object):
+    """Builds the job submission command for one type of job scheduler.
+
+    A builder is selected once when the JobRunner is created, so submitting a job does not
+    need to test the scheduler type repeatedly.  The parts of the command line that do not
+    change between jobs are prepared by the constructor.
+    """
+    scheduler_name = None
+    subtask_env_var_name = None
+    dependency_types = ("afterok",)
+
+    def __init__(self, qsub_extra_params=None, cache_cwd=False):
+        self.extra_tokens = tuple(shlex.split(qsub_extra_params)) if qsub_extra_params else ()
+        self.cache_cwd = cache_cwd
+
+    def build(self, job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type):
+        """Create the job submission argument list.  See JobRunner._make_qsub_command() for the parameters."""
+        if dependency_type not in self.dependency_types:
+            raise ValueError("dependency_type %s is not supported by %s" % (dependency_type, self.scheduler_name))
+        # Always build new lists, the caller's lists must not be modified
+        wait_for = [wait_for] if isinstance(wait_for, str) else (list(wait_for) if wait_for else [])
+        wait_for_array = [wait_for_array] if isinstance(wait_for_array, str) else (list(wait_for_array) if wait_for_array else [])
+        parts = self.build_command(job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type)
+        parts.extend(self.extra_tokens)
+        return parts
+
+    def build_command(self, job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type):
+        """Create the scheduler-specific part of the job submission argument list."""
+        raise NotImplementedError
+
+    def wrap_script(self, script):
+        """Add any header required by the scheduler to a job script."""
+        return script
+
+    def format_log_suffix(self, log_file):
+        """Return the log file path of an array job, with a suffix expanded by the scheduler to the sub-task number."""
+        return log_file
+
+    def strip_array_suffix(self, job_id):
+        """Remove the dot and everything after it from an array job id.
+
+        Examples
+        --------
+        >>> _TorqueBuilder().strip_array_suffix("123[].server")
+        '123[]'
+        >>> _TorqueBuilder().strip_array_suffix("123")
+        '123'
+        >>> _TorqueBuilder().strip_array_suffix(".123")
+        '.123'
+        """
+        head, sep, _ = job_id.partition('.')
+        if sep and head:
+            job_id = head
+        return job_id
+
+    def status_args(self, job_ids):
+        """Create the argument list of a single command reporting the state of all the job_ids."""
+        raise NotImplementedError
+
+    def parse_status(self, output, job_ids):
+        """Parse the output of the status command into a dict mapping each of the job_ids to one of JOB_STATES."""
+        raise NotImplementedError
+
+    def collect_states(self, job_ids, found):
+        """Combine the states found for each job, reporting jobs not found as UNKNOWN.
+
+        Parameters
+        ----------
+        job_ids : list of str
+            Requested job ids.  Any dot suffix is ignored when matching the status command output.
+        found : dict of str to list of str
+            States of the jobs and array sub-tasks found in the status command output, by job id without a dot suffix.
+
+        Returns
+        -------
+        states : dict of str to str
+            State of each requested job id.
+        """
+        states = dict()
+        for job_id in job_ids:
+            sub_states = found.get(job_id.partition('.')[0])
+            states[job_id] = _combine_states(sub_states) if sub_states else "UNKNOWN"
+        return states
+
+
+class _GridBuilder(_QsubBuilder):
+    scheduler_name = "grid engine"
+    subtask_env_var_name = "SGE_TASK_ID"
+    dependency_types = ("afterok", "afterany")
+
+    def build_command(self, job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type):
+        parts = ["qsub", "-terse"]
+        if num_tasks:
+            parts.extend(["-t", "1-" + str(num_tasks)])
+        parts.extend(["-V", "-j", "y", "-cwd", "-N", job_name, "-o", log_file])
+
+        if slot_dependency:
+            if wait_for:
+                parts.extend(["-hold_jid", ','.join(wait_for)])
+            if wait_for_array:
+                parts.extend(["-hold_jid_ad", ','.join(wait_for_array)])
+        elif wait_for or wait_for_array:
+            parts.extend(["-hold_jid", ','.join(wait_for + wait_for_array)])
+
+        if max_processes:
+            parts.extend(["-tc", str(max_processes)])
+        if threads > 1:
+            if not parallel_environment:
+                raise ValueError("You must use a parallel environment when consuming more than one thread on grid engine")
+            parts.extend(["-pe", parallel_environment, str(threads)])
+
+        if wall_clock_limit:
+            parts.extend(["-l", "h_rt=" + wall_clock_limit])
+        return parts
+
+    def format_log_suffix(self, log_file):
+        return log_file + "-$TASK_ID"
+
+    def status_args(self, job_ids):
+        return ["qstat"]  # grid engine does not retain finished jobs, which are reported as UNKNOWN
+
+    def parse_status(self, output, job_ids):
+        """
+        Examples
+        --------
+        >>> output = '''job-ID  prior   name       user         state submit/start at     queue      slots ja-task-ID
+        ... -------------------------------------------------------------------------------------------------
+        ...     123 0.55500 JobName    user         r     01/01/2020 10:00:00 all.q@node1    1
+        ...     124 0.00000 JobName    user         qw    01/01/2020 10:00:00                1 1-10:1
+        ...     125 0.00000 JobName    user         Eqw   01/01/2020 10:00:00                1
+        ... '''
+        >>> sorted(_GridBuilder().parse_status(output, ["123", "124", "125", "126"]).items())
+        [('123', 'RUNNING'), ('124', 'PENDING'), ('125', 'FAILED'), ('126', 'UNKNOWN')]
+        """
+        found = dict()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 5 or not fields[0].isdigit():
+                continue  # header
+            code = fields[4]
+            if 'E' in code or 'd' in code:
+                state = "FAILED"
+            elif any(c in code for c in "rtsST"):
+                state = "RUNNING"
+            elif any(c in code for c in "qwh"):
+                state = "PENDING"
+            else:
+                state = "UNKNOWN"
+            found.setdefault(fields[0], []).append(state)
+        return self.collect_states(job_ids, found)
+
+
+class _SlurmBuilder(_QsubBuilder):
+    scheduler_name = "slurm"
+    subtask_env_var_name = "SLURM_ARRAY_TASK_ID"
+    dependency_types = ("afterok", "afterany", "afternotok", "singleton")
+
+    def build_command(self, job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type):
+        parts = ["sbatch", "--parsable"]
+        if exclusive:
+            parts.append("--exclusive")
+        if num_tasks:
+            max_processes_option = "%%%i" % max_processes if max_processes else ""
+            parts.append("--array=1-" + str(num_tasks) + max_processes_option)
+        parts.extend(["--export=ALL", "--job-name=" + job_name, "-o", log_file])
+
+        # One string per dependency predicate, joined once
+        if not slot_dependency:
+            wait_for = wait_for + wait_for_array  # combine lists
+            wait_for_array = None
+        dependencies = []
+        if dependency_type == "singleton":
+            dependency_type = "afterok"
+            dependencies.append("singleton")
+        if wait_for:
+            dependencies.append(dependency_type + ":" + ':'.join(wait_for))
+        if wait_for_array:
+            dependencies.append("aftercorr:" + ':'.join(wait_for_array))
+        if dependencies:
+            parts.append("--dependency=" + ','.join(dependencies))
+
+        if threads > 1:
+            parts.append("--cpus-per-task=" + str(threads))
+
+        if wall_clock_limit:
+            parts.extend(["--time", wall_clock_limit])
+        return parts
+
+    def wrap_script(self, script):
+        return "#!/bin/sh\n" + script  # sbatch requires a shebang line
+
+    def format_log_suffix(self, log_file):
+        return log_file + "-%a"
+
+    pending_states = {"PENDING", "CONFIGURING", "REQUEUED", "REQUEUE_FED", "REQUEUE_HOLD", "RESV_DEL_HOLD"}
+    running_states = {"RUNNING", "COMPLETING", "RESIZING", "SIGNALING", "STAGE_OUT", "STOPPED", "SUSPENDED"}
+    failed_states = {"FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "OUT_OF_MEMORY", "BOOT_FAIL", "DEADLINE", "PREEMPTED", "REVOKED", "SPECIAL_EXIT"}
+
+    def status_args(self, job_ids):
+        return ["squeue", "--noheader", "--states=all", "-o", "%i %T", "-j", ','.join(job_ids)]
+
+    def parse_status(self, output, job_ids):
+        """
+        Examples
+        --------
+        >>> output = "123 RUNNING\\n124_1 COMPLETED\\n124_2 RUNNING\\n124_[3-9] PENDING\\n125 TIMEOUT\\n126 COMPLETED\\n"
+        >>> sorted(_SlurmBuilder().parse_status(output, ["123", "124", "125", "126", "127"]).items())
+        [('123', 'RUNNING'), ('124', 'RUNNING'), ('125', 'FAILED'), ('126', 'COMPLETED'), ('127', 'UNKNOWN')]
+        """
+        found = dict()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            slurm_state = fields[1].rstrip('+')
+            if slurm_state in self.pending_states:
+                state = "PENDING"
+            elif slurm_state in self.running_states:
+                state = "RUNNING"
+            elif slurm_state == "COMPLETED":
+                state = "COMPLETED"
+            elif slurm_state in self.failed_states:
+                state = "FAILED"
+            else:
+                state = "UNKNOWN"
+            job_id = fields[0].partition('_')[0]  # array sub-tasks are reported as JOBID_TASKID
+            found.setdefault(job_id, []).append(state)
+        return self.collect_states(job_ids, found)
+
+
+class _TorqueBuilder(_QsubBuilder):
+    scheduler_name = "torque"
+    subtask_env_var_name = "PBS_ARRAYID"
+    dependency_types = ("afterok", "afterany", "afternotok")
+
+    def __init__(self, qsub_extra_params=None, cache_cwd=False):
+        super(_TorqueBuilder, self).__init__(qsub_extra_params, cache_cwd)
+        self.cwd = os.getcwd() if cache_cwd else None
+
+    def build_command(self, job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type):
+        parts = ["qsub"]
+        if num_tasks:
+            max_processes_option = "%%%i" % max_processes if max_processes else ""
+            parts.extend(["-t", "1-" + str(num_tasks) + max_processes_option])
+        parts.extend(["-V", "-j", "oe", "-d", self.cwd or os.getcwd(), "-N", job_name, "-o", log_file])
+
+        # One string per dependency predicate, joined once
+        dependencies = []
+        if wait_for:
+            dependencies.append(dependency_type + ":" + ':'.join(wait_for))
+        if wait_for_array:
+            dependencies.append(dependency_type + "array:" + ':'.join(wait_for_array))
+        if dependencies:
+            parts.extend(["-W", "depend=" + ','.join(dependencies)])
+
+        if threads > 1:
+            parts.extend(["-l", "nodes=1:ppn=" + str(threads)])
+
+        if wall_clock_limit:
+            parts.extend(["-l", "walltime=" + wall_clock_limit])
+        return parts
+
+    def status_args(self, job_ids):
+        return ["qstat", "-f"] + list(job_ids)
+
+    def parse_status(self, output, job_ids):
+        """
+        Examples
+        --------
+        >>> output = '''Job Id: 123.server
+        ...     Job_Name = JobName
+        ...     job_state = R
+        ... Job Id: 124[].server
+        ...     job_state = Q
+        ... Job Id: 125.server
+        ...     job_state = C
+        ...     exit_status = 0
+        ... Job Id: 126.server
+        ...     job_state = C
+        ...     exit_status = 1
+        ... '''
+        >>> sorted(_TorqueBuilder().parse_status(output, ["123", "124[]", "125.server", "126", "127"]).items())
+        [('123', 'RUNNING'), ('124[]', 'PENDING'), ('125.server', 'COMPLETED'), ('126', 'FAILED'), ('127', 'UNKNOWN')]
+        """
+        found = dict()
+        job_id = None
+        for line in output.splitlines():
+            name, _, value = line.partition(':' if line.startswith("Job Id:") else '=')
+            name = name.strip()
+            value = value.strip()
+            if name == "Job Id":
+                job_id = value.partition('.')[0]
+            elif job_id and name == "job_state":
+                if value in "QHWT":
+                    state = "PENDING"
+                elif value in "RES":
+                    state = "RUNNING"
+                elif value == 'C':
+                    state = "COMPLETED"
+                else:
+                    state = "UNKNOWN"
+                found[job_id] = [state]
+            elif job_id and name == "exit_status" and value != '0' and found.get(job_id) == ["COMPLETED"]:
+                found[job_id] = ["FAILED"]
+        return self.collect_states(job_ids, found)
+
+
+_BUILDERS = {
+    "grid": _GridBuilder,
+    "slurm": _SlurmBuilder,
+    "torque": _TorqueBuilder,
+}
+
+
 class JobRunner(object):
-    def __init__(self, hpc_type, strip_job_array_suffix=True, qsub_extra_params=None, exception_handler=None, verbose=False):
+    def __init__(self, hpc_type, strip_job_array_suffix=True, qsub_extra_params=None, exception_handler=None, verbose=False, submit_fanout=32, max_submits_per_sec=None, cache_cwd=False, reuse_shell=False, local_backend="xargs", pin_math_threads=False, max_workers=None):
         """Initialize an hpc job runner object.
 
         Parameters
@@ -41,6 +1058,40 @@ class JobRunner(object):
             external process. The function will be called with the arguments (exc_type, exc_value, exc_traceback).
         verbose : bool, optional defaults to False
             When true, the job command lines are logged.
+        submit_fanout : int, optional defaults to 32
+            Maximum number of jobs submitted concurrently by run_async().
+        max_submits_per_sec : float, optional defaults to None
+            When specified, job submissions to grid, slurm, or torque are delayed as needed to stay
+            under this rate, avoiding timeouts when the job scheduler is overloaded.  Submitting
+            many tasks as one array job with run_array() or run_many() is the preferred remedy.
+        cache_cwd : bool, optional defaults to False
+            Torque only.  When true, the current working directory of the jobs is captured once when
+            the JobRunner is created rather than each time a job is submitted.  Do not enable this if
+            the program changes its working directory between job submissions.
+        reuse_shell : bool, optional defaults to False
+            Local mode only.  When true, the commands executed by run() are fed to a single long-lived
+            bash process instead of starting a new shell for each job.  The commands still run in a
+            subshell with standard input from /dev/null, but they do not see changes made to the
+            environment variables of the Python process after the first job runs.  With the "pool"
+            local backend, the tasks of run_array() are likewise fed to a set of long-lived shells, one
+            per worker thread, and $0 is not the task number.  Call close() to terminate the shells.
+        local_backend : str, optional defaults to "xargs"
+            Local mode only.  Selects how run_array() executes the tasks in parallel.  With "xargs", the
+            array file is piped through xargs.  With "pool", the array file is read in Python and the tasks
+            are dispatched to a pool of worker threads, each one supervising one task process at a time.
+            No Python worker processes are started, so the pool does not depend on the multiprocessing
+            start method and starts as quickly on macOS as on Linux.
+            The pool reports the exit status of each failed task.
+            The pool is kept for the following array jobs until close() is called.
+        pin_math_threads : bool, optional defaults to False
+            Local mode only.  When true, the OpenMP, MKL, and OpenBLAS thread pools of each job are limited
+            to the number of threads requested by the job, which defaults to 1.  This prevents parallel
+            array tasks from oversubscribing the CPU cores.  Variables already set in the environment of
+            the Python process are not changed.
+        max_workers : int, optional defaults to None
+            Local mode only.  Maximum number of tasks of a local array job running concurrently when
+            run_array() is called without max_processes.  If None, it is the number of CPU cores usable
+            by this process.
 
         Examples
         --------
@@ -51,21 +1102,37 @@ class JobRunner(object):
         hpc_type = hpc_type.lower()
         if hpc_type not in ["grid", "slurm", "torque", "local"]:
             raise ValueError('hpc_type must be one of: "grid", "slurm", "torque", "local"')
+        if local_backend not in ["xargs", "pool"]:
+            raise ValueError('local_backend must be one of: "xargs", "pool"')
 
         self.hpc_type = hpc_type
         self.strip_job_array_suffix = strip_job_array_suffix
         self.qsub_extra_params = qsub_extra_params
         self.exception_handler = exception_handler
         self.verbose = verbose
-
-        if hpc_type == 'grid':
-            self.subtask_env_var_name = "SGE_TASK_ID"
-        elif hpc_type == 'slurm':
-            self.subtask_env_var_name = "SLURM_ARRAY_TASK_ID"
-        elif hpc_type == 'torque':
-            self.subtask_env_var_name = "PBS_ARRAYID"
-
-    def _make_qsub_command(self, job_name, log_file, wait_for=[], wait_for_array=[], slot_dependency=False, threads=1, parallel_environment=None, num_tasks=None, max_processes=None, exclusive=False, wall_clock_limit=None):
+        self.cache_cwd = cache_cwd
+        self.reuse_shell = reuse_shell
+        self.local_backend = local_backend
+        self.pin_math_threads = pin_math_threads
+        self.max_workers = max_workers
+        self._bash = None
+        self.submit_fanout = submit_fanout
+        self._executor = None
+        self._pool = None
+        self._pool_workers = None
+        self._pool_lock = threading.Lock()
+        self._shells = queue.Queue()  # idle bash coprocesses running array job tasks when reuse_shell is true
+        self._min_submit_interval = 1.0 / max_submits_per_sec if max_submits_per_sec else None
+        self._last_submit_time = None
+        self._submit_lock = threading.Lock()
+
+        # Select the job submission command builder once, rather than for every job
+        self._builder = None
+        if hpc_type in _BUILDERS:
+            self._builder = _BUILDERS[hpc_type](qsub_extra_params, cache_cwd)
+            self.subtask_env_var_name = self._builder.subtask_env_var_name
+
+    def _make_qsub_command(self, job_name, log_file, wait_for=None, wait_for_array=None, slot_dependency=False, threads=1, parallel_environment=None, num_tasks=None, max_processes=None, exclusive=False, wall_clock_limit=None, dependency_type="afterok"):
         """Create the command line to run a job on a computing cluster.
 
         Parameters
@@ -74,9 +1141,9 @@ class JobRunner(object):
             Job name that will appear in the job scheduler queue.
         log_file : str
             Path to the combined stdout / stderr log file.
-        wait_for : str or list of str, optional defaults to empty list
+        wait_for : str or list of str, optional defaults to None
             Single job id or list of jobs ids to wait for before beginning execution.
-        wait_for_array : str or list of str, optional defaults to empty list
+        wait_for_array : str or list of str, optional defaults to None
             Single array job id or list of array jobs ids to wait for before beginning execution.
         slot_dependency : bool, optional defaults to False
             Enforced for grid engine and slurm only.  Ignored for all other schedulers.
@@ -97,6 +1164,12 @@ class JobRunner(object):
             Enforced only on SLURM, silently ignored for all other schedulers.
         wall_clock_limit : str, optional, defaults to None
             Maximum run-time; string of the form HH:MM:SS.
+        dependency_type : str, optional, defaults to "afterok"
+            Condition on the jobs in wait_for and wait_for_array that must be met before the job can start.
+            One of "afterok", "afterany", "afternotok", or "singleton".  Slurm and torque support "afterok",
+            "afterany", and "afternotok".  Slurm also supports "singleton", which additionally waits for all
+            previous jobs with the same job name to finish.  Grid engine only supports "afterok" and "afterany",
+            which are equivalent because grid engine waits for jobs to finish regardless of their exit status.
 
 
         Returns
@@ -148,6 +1221,16 @@ class JobRunner(object):
         >>> runner._make_qsub_command("JobName", "log", ["666", "777"], ["888", "999"], slot_dependency=False, threads=8, num_tasks=44, max_processes=2, exclusive=True)
         'sbatch --parsable --exclusive --array=1-44%2 --export=ALL --job-name=JobName -o log --dependency=afterok:666:777:888:999 --cpus-per-task=8 -p short.q'
 
+        # other dependency types
+        >>> runner._make_qsub_command("JobName", "log", ["666", "777"], ["888", "999"], slot_dependency=True, num_tasks=44, dependency_type="afterany")
+        'sbatch --parsable --array=1-44 --export=ALL --job-name=JobName -o log --dependency=afterany:666:777,aftercorr:888:999 -p short.q'
+
+        >>> runner._make_qsub_command("JobName", "log", dependency_type="singleton")
+        'sbatch --parsable --export=ALL --job-name=JobName -o log --dependency=singleton -p short.q'
+
+        >>> runner._make_qsub_command("JobName", "log", "777", dependency_type="singleton")
+        'sbatch --parsable --export=ALL --job-name=JobName -o log --dependency=singleton,afterok:777 -p short.q'
+
         # torque
         # =======
         >>> runner = JobRunner("torque", qsub_extra_params="-q short.q")
@@ -163,98 +1246,121 @@ class JobRunner(object):
         >>> cmd = runner._make_qsub_command("JobName", "log", ["666", "777"], ["888", "999"], slot_dependency=True, threads=8, num_tasks=44, max_processes=2)
         >>> cmd == "qsub -t 1-44%%2 -V -j oe -d %s -N JobName -o log -W depend=afterok:666:777,afterokarray:888:999 -l nodes=1:ppn=8 -q short.q" % os.getcwd()
         True
+
+        >>> cmd = runner._make_qsub_command("JobName", "log", "777", "888", dependency_type="afternotok")
+        >>> cmd == "qsub -V -j oe -d %s -N JobName -o log -W depend=afternotok:777,afternotokarray:888 -q short.q" % os.getcwd()
+        True
+
+        >>> runner._make_qsub_command("JobName", "log", "777", dependency_type="singleton")
+        Traceback (most recent call last):
+        ValueError: dependency_type singleton is not supported by torque
+
+        # working directory captured once
+        >>> runner = JobRunner("torque", cache_cwd=True)
+        >>> cmd = runner._make_qsub_command("JobName", "log")
+        >>> cmd == "qsub -V -j oe -d %s -N JobName -o log" % os.getcwd()
+        True
+
+        # the caller's dependency lists are not modified
+        >>> runner = JobRunner("slurm")
+        >>> wait_for = ["666"]
+        >>> runner._make_qsub_command("JobName", "log", wait_for, ["888"])
+        'sbatch --parsable --export=ALL --job-name=JobName -o log --dependency=afterok:666:888'
+        >>> wait_for
+        ['666']
+        """
+        qsub_args = self._make_qsub_args(job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type)
+        return ' '.join(qsub_args)
+
+    def _make_qsub_args(self, job_name, log_file, wait_for=None, wait_for_array=None, slot_dependency=False, threads=1, parallel_environment=None, num_tasks=None, max_processes=None, exclusive=False, wall_clock_limit=None, dependency_type="afterok"):
+        """Create the argument list to run a job on a computing cluster.
+
+        The parameters are the same as _make_qsub_command().
+
+        Returns
+        -------
+        qsub_args : list of str
+            Job submission command and arguments for Grid, SLURM, or torque, ready to execute without a shell.
         """
-        if self.hpc_type not in ["grid", "slurm", "torque"]:
+        if self._builder is None:
             raise ValueError("_make_qsub_command() does not support hpc type %s" % self.hpc_type)
+        return self._builder.build(job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive, wall_clock_limit, dependency_type)
 
-        if self.hpc_type == "grid":
-            array_option = " -t 1-" + str(num_tasks) if num_tasks else ""
-            qsub_command_line = "qsub -terse" + array_option + " -V -j y -cwd -N " + job_name + " -o " + log_file
-
-            if isinstance(wait_for, str):
-                wait_for = [wait_for]
-            if isinstance(wait_for_array, str):
-                wait_for_array = [wait_for_array]
-            if not slot_dependency:
-                wait_for.extend(wait_for_array)  # combine lists
-            if len(wait_for) > 0:
-                qsub_command_line += " -hold_jid " + ','.join(wait_for)
-            if slot_dependency and len(wait_for_array) > 0:
-                qsub_command_line += " -hold_jid_ad " + ','.join(wait_for_array)
-
-            if max_processes:
-                qsub_command_line += " -tc " + str(max_processes)
-            if threads > 1:
-                if not parallel_environment:
-                    raise ValueError("You must use a parallel environment when consuming more than one thread on grid engine")
-                qsub_command_line += " -pe " + parallel_environment + ' ' + str(threads)
-
-            if wall_clock_limit:
-                qsub_command_line += " -l h_rt=" + wall_clock_limit
-
-            if self.qsub_extra_params:
-                qsub_command_line += ' ' + self.qsub_extra_params
-            return qsub_command_line
-
-        if self.hpc_type == "slurm":
-            exclusive_option = " --exclusive" if exclusive else ""
-            max_processes_option = "%%%i" % max_processes if max_processes else ""
-            array_option = " --array=1-" + str(num_tasks) + max_processes_option if num_tasks else ""
-            qsub_command_line = "sbatch --parsable" + exclusive_option + array_option + " --export=ALL --job-name=" + job_name + " -o " + log_file
-
-            if isinstance(wait_for, str):
-                wait_for = [wait_for]
-            if isinstance(wait_for_array, str):
-                wait_for_array = [wait_for_array]
-            if not slot_dependency:
-                wait_for.extend(wait_for_array)  # combine lists
-                wait_for_array = []
-            dependencies = []
-            if len(wait_for) > 0:
-                dependencies.append("afterok:" + ':'.join(wait_for))
-            if len(wait_for_array) > 0 and slot_dependency:
-                dependencies.append("aftercorr:" + ':'.join(wait_for_array))
-            if len(dependencies) > 0:
-                qsub_command_line += " --dependency=" + ','.join(dependencies)
-
-            if threads > 1:
-                qsub_command_line += " --cpus-per-task=" + str(threads)
-
-            if wall_clock_limit:
-                qsub_command_line += " --time " + wall_clock_limit
-
-            if self.qsub_extra_params:
-                qsub_command_line += ' ' + self.qsub_extra_params
-            return qsub_command_line
-
-        if self.hpc_type == "torque":
-            max_processes_option = "%%%i" % max_processes if max_processes else ""
-            array_option = " -t 1-" + str(num_tasks) + max_processes_option if num_tasks else ""
-            qsub_command_line = "qsub" + array_option + " -V -j oe -d " + os.getcwd() + " -N " + job_name + " -o " + log_file
-
-            if isinstance(wait_for, str):
-                wait_for = [wait_for]
-            if isinstance(wait_for_array, str):
-                wait_for_array = [wait_for_array]
-            dependencies = []
-            if len(wait_for) > 0:
-                dependencies.append("afterok:" + ':'.join(wait_for))
-            if len(wait_for_array) > 0:
-                dependencies.append("afterokarray:" + ':'.join(wait_for_array))
-            if len(dependencies) > 0:
-                qsub_command_line += " -W depend=" + ','.join(dependencies)
-
-            if threads > 1:
-                qsub_command_line += " -l nodes=1:ppn=" + str(threads)
-
-            if wall_clock_limit:
-                qsub_command_line += " -l walltime=" + wall_clock_limit
-
-            if self.qsub_extra_params:
-                qsub_command_line += ' ' + self.qsub_extra_params
-            return qsub_command_line
-
-    def run(self, command_line, job_name, log_file, wait_for=[], wait_for_array=[], threads=1, parallel_environment=None, exclusive=False, wall_clock_limit=None, quiet=False):
+    def _math_thread_exports(self, threads):
+        """Create the shell commands limiting the thread pools of numerical libraries in a local job.
+
+        Parameters
+        ----------
+        threads : int
+            Number of threads consumed by the job.
+
+        Returns
+        -------
+        exports : str
+            Shell export command followed by a semicolon, or an empty string when pin_math_threads is false.
+
+        Examples
+        --------
+        >>> runner = JobRunner("local", pin_math_threads=True)
+        >>> exports = runner._math_thread_exports(2)
+        >>> "OPENBLAS_NUM_THREADS" in os.environ or "OPENBLAS_NUM_THREADS=2" in exports
+        True
+        """
+        if not self.pin_math_threads:
+            return ""
+        names = [name for name in _MATH_THREAD_ENV_VARS if name not in os.environ]
+        if not names:
+            return ""
+        return "export " + ' '.join("%s=%i" % (name, threads) for name in names) + "; "
+
+    def _throttle(self):
+        """Sleep as needed to keep job submissions under the max_submits_per_sec rate."""
+        with self._submit_lock:
+            now = time.monotonic()
+            if self._last_submit_time is not None:
+                wait = self._min_submit_interval - (now - self._last_submit_time)
+                if wait > 0:
+                    time.sleep(wait)
+                    now += wait
+            self._last_submit_time = now
+
+    def _submit_one(self, qsub_args, script):
+        """Submit a job script and return the job id printed by the scheduler.
+
+        The job script is fed to the standard input of qsub or sbatch directly, without a shell.
+
+        Parameters
+        ----------
+        qsub_args : list of str
+            Job submission command and arguments created by _make_qsub_args().
+        script : str
+            Commands to be executed on the compute node.
+
+        Returns
+        -------
+        job_id : str
+            Job id with surrounding whitespace removed.
+
+        Raises
+        ------
+        CalledProcessError
+
+        If the job submission command returns a non-zero exit code, CalledProcessError is raised.
+        """
+        if self._min_submit_interval:
+            self._throttle()
+
+        script = (self._builder.wrap_script(script) + "\n").encode(std_encoding)
+
+        # Run command and return its stdout output as a byte string.
+        # If the return code was non-zero it raises a CalledProcessError.
+        process = subprocess.Popen(qsub_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        job_id, _ = process.communicate(script)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, qsub_args, job_id)
+        return _decode_bytes(job_id).strip()
+
+    def run(self, command_line, job_name, log_file, wait_for=None, wait_for_array=None, threads=1, parallel_environment=None, exclusive=False, wall_clock_limit=None, quiet=False, dependency_type="afterok"):
         """Run a non-array job.  Stderr is redirected (joined) to stdout.
 
         Parameters
@@ -264,15 +1370,16 @@ class JobRunner(object):
         job_name : str
             Job name that will appear in the job scheduler queue.
         log_file : str
-            Path to the combined stdout / stderr log file.
-        wait_for : str or list of str, optional defaults to empty list
+            Path to the combined stdout / stderr log file.  When running locally with quiet set, an
+            empty string, None, or os.devnull discards the output without opening a log file.
+        wait_for : str or list of str, optional defaults to None
             Single job id or list of jobs ids to wait for before beginning execution.
             Ignored when running locally.
-        wait_for_array : str or list of str, optional defaults to empty list
+        wait_for_array : str or list of str, optional defaults to None
             Single array job id or list of array jobs ids to wait for before beginning execution.
             Ignored when running locally.
         threads : int, optional defaults to 1
-            Number of CPU threads consumed by the job, unused when running locally.
+            Number of CPU threads consumed by the job.  When running locally, it is only used by pin_math_threads.
         parallel_environment : str, optional defaults to None
             Name of the grid engine parallel execution environment.  This must be specified when
             consuming more than one thread on grid engine.  Ununsed for any other job scheduler.
@@ -286,6 +1393,13 @@ class JobRunner(object):
             Controls whether the job stderr and stdout are written to stdout in addition to the log file.
             By default, the job stderr and stdout are written to both stdout and the log file.
             When True, the job stderr and stdout are written to the log file only.
+        dependency_type : str, optional, defaults to "afterok"
+            Condition on the jobs in wait_for and wait_for_array that must be met before the job can start.
+            One of "afterok", "afterany", "afternotok", or "singleton".  Slurm and torque support "afterok",
+            "afterany", and "afternotok".  Slurm also supports "singleton", which additionally waits for all
+            previous jobs with the same job name to finish.  Grid engine only supports "afterok" and "afterany",
+            which are equivalent because grid engine waits for jobs to finish regardless of their exit status.
+            Ignored when running locally.
 
         Returns
         -------
@@ -319,11 +1433,20 @@ class JobRunner(object):
         >>> # Need to ignore exception details to work with both python2 and python3.
         >>> job_id = runner.run("exit 100", "JobName", "") # doctest: +IGNORE_EXCEPTION_DETAIL
         Traceback (most recent call last):
-        CalledProcessError: Command 'set -o pipefail; exit 100 2>&1 | tee ' returned non-zero exit status 100
+        CalledProcessError: Command 'set -o pipefail; exit 100' returned non-zero exit status 100
         """
         if self.hpc_type == "local":
-            redirection = " > " + log_file + " 2>&1 " if quiet else " 2>&1 | tee " + log_file
-            command_line = "set -o pipefail; " + command_line + redirection
+            exports = self._math_thread_exports(threads)
+            if quiet and log_file in ("", None, os.devnull):
+                log_file = ""  # discard the output
+            if self.reuse_shell:
+                redirection = " > " + (log_file or os.devnull) + " 2>&1 " if quiet else " 2>&1 | tee " + log_file
+                command_line = exports + "set -o pipefail; " + command_line + redirection
+            else:
+                # The output is redirected or copied to the log file by python.  Plain commands are executed without starting bash.
+                args = None if exports else _split_plain_command(command_line)
+                command_line = exports + "set -o pipefail; " + command_line
+                args = args or [_BASH, "-c", command_line]
             if self.verbose:
                 print(command_line)
 
@@ -332,7 +1455,16 @@ class JobRunner(object):
 
             # Run command. Wait for command to complete. If the return code was zero then return, otherwise raise CalledProcessError
             try:
-                subprocess.check_call(command_line, shell=True, executable="bash")
+                if self.reuse_shell:
+                    if self._bash is None:
+                        self._bash = _BashCoprocess()
+                    return_code = self._bash.run(command_line)
+                    if return_code != 0:
+                        raise subprocess.CalledProcessError(return_code, command_line)
+                else:
+                    return_code = _run_to_log(args, log_file) if quiet else _run_tee(args, log_file)
+                    if return_code != 0:
+                        raise subprocess.CalledProcessError(return_code, command_line)
             except subprocess.CalledProcessError:
                 if self.exception_handler:
                     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -342,26 +1474,58 @@ class JobRunner(object):
             return '0'
 
         else:  # grid, slurm, or torque
-            qsub_command_line = self._make_qsub_command(job_name, log_file, wait_for, wait_for_array, threads=threads, parallel_environment=parallel_environment, exclusive=exclusive, wall_clock_limit=wall_clock_limit)
-
-            # Run command and return its stdout output as a byte string.
-            # If the return code was non-zero it raises a CalledProcessError.
-
-            if self.hpc_type == "slurm":
-                command_line = "'#!/bin/sh\\n'" + command_line
-
-            shell_command_line = "echo -e " + command_line + " | " + qsub_command_line
+            qsub_args = self._make_qsub_args(job_name, log_file, wait_for, wait_for_array, threads=threads, parallel_environment=parallel_environment, exclusive=exclusive, wall_clock_limit=wall_clock_limit, dependency_type=dependency_type)
             if self.verbose:
-                print(shell_command_line)
-            job_id = subprocess.check_output(shell_command_line, shell=True)
-            if sys.version_info > (3,):
-                job_id = job_id.decode(std_encoding)  # Python 3 stdout is bytes, not str
-            job_id = job_id.strip()
+                print(' '.join(qsub_args))
+                print(command_line)
+            job_id = self._submit_one(qsub_args, command_line)
             if self.verbose:
                 print("Job id=" + job_id)
             return job_id
 
-    def run_array(self, command_line, job_name, log_file, array_file, num_tasks=None, max_processes=None, wait_for=[], wait_for_array=[], slot_dependency=False, threads=1, parallel_environment=None, array_subshell=True, exclusive=False, wall_clock_limit=None, quiet=False):
+    def run_async(self, command_line, job_name, log_file, **kwargs):
+        """Run a non-array job in a background thread without waiting for the submission to complete.
+
+        Up to submit_fanout jobs are submitted concurrently, overlapping the latency of the
+        job scheduler.  All the parameters are the same as run().
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Future whose result is the job id returned by run().  Use wait_all() to collect
+            the job ids of several futures.
+
+        Examples
+        --------
+        >>> runner = JobRunner("local")
+        >>> futures = [runner.run_async("true", "JobName", os.devnull) for i in range(3)]
+        >>> runner.wait_all(futures)
+        ['0', '0', '0']
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.submit_fanout)
+        return self._executor.submit(self.run, command_line, job_name, log_file, **kwargs)
+
+    def wait_all(self, futures):
+        """Wait for the submission of jobs started with run_async().
+
+        Parameters
+        ----------
+        futures : list of concurrent.futures.Future
+            Futures returned by run_async().
+
+        Returns
+        -------
+        job_ids : list of str
+            Job ids in the same order as the futures.
+
+        Raises
+        ------
+        The first exception raised by any of the submissions is re-raised.
+        """
+        return [future.result() for future in futures]
+
+    def run_array(self, command_line, job_name, log_file, array_file, num_tasks=None, max_processes=None, wait_for=None, wait_for_array=None, slot_dependency=False, threads=1, parallel_environment=None, array_subshell=True, exclusive=False, wall_clock_limit=None, quiet=False, dependency_type="afterok", chunk_size=1, pre_substitute=False, batch=False):
         """Run an array of sub-tasks with the work of each task defined by a single line in the specified array_file.
 
         Parameters
@@ -383,13 +1547,13 @@ class JobRunner(object):
             when the array_file does not pre-exist and is created by a process that has not run yet.
         max_processes : int, optional defaults to None
             If None, the number of concurrent processes is limited to available CPU on an HPC
-            and limited to the number of CPU cores when run locally.
+            and limited to max_workers, or the number of CPU cores usable by this process, when run locally.
             If not None, it sets the maximium number of concurrent processes for the array job.
             This works locally with xargs, and with grid and torque.
-        wait_for : str or list of str, optional defaults to empty list
+        wait_for : str or list of str, optional defaults to None
             Single job id or list of jobs ids to wait for before beginning execution.
             Ignored when running locally.
-        wait_for_array : str or list of str, optional defaults to empty list
+        wait_for_array : str or list of str, optional defaults to None
             Single array job id or list of array jobs ids to wait for before beginning execution.
             Ignored when running locally.
         slot_dependency : bool, optional defaults to False
@@ -398,7 +1562,7 @@ class JobRunner(object):
             completion of the corresponding sub-tasks of the jobs in the wait_for_array.  Has
             no effect on the dependencies of non-array jobs.
         threads : int, optional defaults to 1
-            Number of CPU threads consumed by each sub-task of the job, unused when running locally.
+            Number of CPU threads consumed by each sub-task of the job.  When running locally, it is only used by pin_math_threads.
         parallel_environment : str, optional defaults to None
             Name of the grid engine parallel execution environment.
             Ununsed for any other job scheduler.
@@ -415,6 +1579,33 @@ class JobRunner(object):
             Controls whether the job stderr and stdout are written to stdout in addition to the log file.
             By default, the job stderr and stdout are written to both stdout and the log file.
             When True, the job stderr and stdout are written to the log file only.
+        dependency_type : str, optional, defaults to "afterok"
+            Condition on the jobs in wait_for and wait_for_array that must be met before the job can start.
+            One of "afterok", "afterany", "afternotok", or "singleton".  Slurm and torque support "afterok",
+            "afterany", and "afternotok".  Slurm also supports "singleton", which additionally waits for all
+            previous jobs with the same job name to finish.  Grid engine only supports "afterok" and "afterany",
+            which are equivalent because grid engine waits for jobs to finish regardless of their exit status.
+            Ignored when running locally.
+        chunk_size : int, optional, defaults to 1
+            Number of consecutive lines of the array_file processed, one after another, by each sub-task
+            of the HPC array job.  Use this to reduce the number of sub-tasks when each one is very short.
+            The sub-task numbers, the log file suffixes, and the max_processes limit refer to the chunks
+            rather than the lines.  Cannot be combined with slot_dependency.
+            Ignored when running locally.
+        pre_substitute : bool, optional, defaults to False
+            When true, the parameters of every line of the array_file are substituted into the command
+            line at submission time and the resulting commands are written to a new file next to the
+            array_file.  Each HPC sub-task then extracts its command with sed instead of starting a
+            qarrayrun Python interpreter.  The array_file is parsed exactly like qarrayrun does.  This
+            option is silently ignored when the array_file does not exist yet, or when the command line
+            spans several lines.  The commands file is not deleted after the job completes.
+            Ignored when running locally.
+        batch : bool, optional, defaults to False
+            Local mode only.  When true, the tasks are divided into one slice per concurrent process,
+            and the tasks of each slice run one after another in a single bash process, each one in a
+            subshell.  This avoids starting a new bash for every task when the tasks are very short.
+            Each task still writes its own log file, but the output is copied to stdout only after
+            all the tasks of its slice complete.
 
         Returns
         -------
@@ -436,28 +1627,39 @@ class JobRunner(object):
             if os.path.getsize(array_file) == 0:
                 raise JobRunnerException("The file %s is empty.\nCannot start array job %s." % (array_file, job_name))
 
-            with open(array_file) as f:
-                num_tasks = sum(1 for line in f)
+            num_tasks = _count_lines(array_file)
 
-        if self.hpc_type == "grid":
-            log_file += "-\\$TASK_ID"
-        elif self.hpc_type == "slurm":
-            log_file += "-%a"
+        if self._builder is not None:
+            log_file = self._builder.format_log_suffix(log_file)
 
         if self.hpc_type == "local":
+            # Plain commands are executed by the pool backend without starting bash for each task
+            exports = self._math_thread_exports(threads)
+            words = None
+            if self.local_backend == "pool" and not exports:
+                words = _split_plain_command(command_line)
+
             # Change parameter placeholder into bash variables ready to feed to bash through xargs
-            for param_num in range(1, 10):
-                placeholder = '{' + str(param_num) + '}'
-                command_line = command_line.replace(placeholder, '$' + str(param_num))
+            command_line = _PLACEHOLDER_RE.sub(r"$\1", command_line)
+            task_command = command_line
 
-            # Use all CPU cores, if no limit requested
+            # Use all usable CPU cores, if no limit requested
             if max_processes is None:
-                max_processes = psutil.cpu_count()
+                max_processes = self.max_workers or _usable_cpus()
 
-            # Number the tasks with nl to get the task number into the log file suffix.
-            # Allow up to 9 parameters per command.
-            redirection = " > " + log_file + "-$0 2>&1'" if quiet else " 2>&1 | tee " + log_file + "-$0'"
-            command_line = "head -n " + str(num_tasks) + " " + array_file + " | nl | xargs -P " + str(max_processes) + " -n 9 -L 1 bash -c + 'set -o pipefail; " + command_line + redirection
+            # The task number is in $0, to be used as the log file suffix.
+            # Each line is passed to one command, but only the first 9 parameters can be referenced.
+            if self.local_backend == "pool":
+                script = exports + "set -o pipefail; " + command_line  # output redirected or copied to the log files by python
+            else:
+                redirection = " > " + log_file + "-$0 2>&1" if quiet else " 2>&1 | tee " + log_file + "-$0"
+                script = exports + "set -o pipefail; " + command_line + redirection
+
+            # Number the tasks with nl to get the task number into $0 when using xargs.
+            if self.local_backend == "xargs":
+                command_line = "head -n " + str(num_tasks) + " " + array_file + " | nl | xargs -P " + str(max_processes) + " -L 1 bash -c + '" + script + "'"
+            else:
+                command_line = script
             if self.verbose:
                 print(command_line)
 
@@ -466,7 +1668,12 @@ class JobRunner(object):
 
             # Run command. Wait for command to complete
             try:
-                subprocess.check_call(command_line, shell=True, executable="bash")  # If the return code is non-zero it raises a CalledProcessError
+                if batch:
+                    self._run_array_batched(task_command, exports, array_file, num_tasks, max_processes, log_file, quiet)
+                elif self.local_backend == "pool":
+                    self._run_array_pool(script, array_file, num_tasks, max_processes, log_file, quiet, words)
+                else:
+                    subprocess.check_call(command_line, shell=True, executable=_BASH, close_fds=False)  # If the return code is non-zero it raises a CalledProcessError
             except subprocess.CalledProcessError:
                 if self.exception_handler:
                     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -476,32 +1683,512 @@ class JobRunner(object):
             return '0'
 
         else:  # grid, slurm, or torque
-            qsub_command_line = self._make_qsub_command(job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_tasks, max_processes, exclusive=exclusive, wall_clock_limit=wall_clock_limit)
+            def make_compute_node_command(subtask_env_var_name):
+                if pre_substitute and os.path.isfile(array_file) and '\n' not in command_line:
+                    commands_file = self._write_commands_file(command_line, array_file, num_tasks, array_subshell)
+                    return _sed_dispatch_command(commands_file, subtask_env_var_name)
+                elif array_subshell:
+                    return "qarrayrun --shell " + subtask_env_var_name + ' ' + array_file + ' "' + command_line + '"'
+                else:
+                    return "qarrayrun " + subtask_env_var_name + ' ' + array_file + ' ' + command_line
+
+            return self._submit_array(make_compute_node_command, job_name, log_file, num_tasks, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, max_processes, exclusive, wall_clock_limit, dependency_type, chunk_size)
+
+    def _submit_array(self, make_compute_node_command, job_name, log_file, num_tasks, wait_for=None, wait_for_array=None, slot_dependency=False, threads=1, parallel_environment=None, max_processes=None, exclusive=False, wall_clock_limit=None, dependency_type="afterok", chunk_size=1):
+        """Submit an array job to grid, slurm, or torque.
 
-            if array_subshell:
-                command_line = '"' + command_line + '"'
-                compute_node_command = "qarrayrun --shell " + self.subtask_env_var_name + ' ' + array_file + ' ' + command_line
+        Parameters
+        ----------
+        make_compute_node_command : callable
+            Called with the name of the environment variable holding the line number of each sub-task,
+            it returns the command executed by the sub-task on the compute node.
+        log_file : str
+            Path to the combined stdout / stderr log file, already suffixed with the sub-task number.
+
+        The other parameters are the same as run_array().
+
+        Returns
+        -------
+        job_id : str
+            Grid, slurm, or torque job id.
+        """
+        num_array_tasks = num_tasks
+        subtask_env_var_name = self.subtask_env_var_name
+        if chunk_size > 1:
+            if slot_dependency:
+                raise ValueError("slot_dependency cannot be combined with chunk_size")
+            num_array_tasks = (num_tasks + chunk_size - 1) // chunk_size
+            subtask_env_var_name = "JOBRUNNER_TASK_ID"  # line number set by the chunk loop below
+
+        qsub_args = self._make_qsub_args(job_name, log_file, wait_for, wait_for_array, slot_dependency, threads, parallel_environment, num_array_tasks, max_processes, exclusive=exclusive, wall_clock_limit=wall_clock_limit, dependency_type=dependency_type)
+
+        compute_node_command = make_compute_node_command(subtask_env_var_name)
+        if chunk_size > 1:
+            compute_node_command = self._make_chunk_loop(compute_node_command, chunk_size, num_tasks)
+
+        if self.verbose:
+            print(' '.join(qsub_args))
+            print(compute_node_command)
+
+        job_id = self._submit_one(qsub_args, compute_node_command)
+        if self.strip_job_array_suffix:
+            job_id = self._builder.strip_array_suffix(job_id)
+        if self.verbose:
+            print("Job id=" + job_id)
+        return job_id
+
+    def _run_array_pool(self, script, array_file, num_tasks, max_processes, log_file, quiet=False, words=None):
+        """Run the tasks of a local array job in a pool of worker threads.
+
+        Parameters
+        ----------
+        script : str
+            Bash script executed for each task, with the array file parameters in $1, $2, ...
+            and the task number in $0.
+        array_file : str
+            Name of the file containing the arguments for each task with one line per task.
+        num_tasks : int
+            Number of lines of the array file to process.
+        max_processes : int
+            Maximum number of tasks executing concurrently.  The pool is sized to the smaller of
+            max_processes and the number of tasks.  The array file is read as the tasks are started,
+            with at most twice that many tasks submitted to the pool at any time.
+        log_file : str
+            Path to the log file of the tasks, to be suffixed with the task number.
+        quiet : bool, optional, defaults to False
+            When true, the output of each task is redirected to its log file.  Otherwise, it is
+            copied to stdout and to its log file.
+        words : list of str, optional, defaults to None
+            Arguments of the command split by _split_plain_command(), when it can be executed without
+            a shell.  The tasks whose parameters would be split or expanded by bash still run the script.
+
+        Raises
+        ------
+        CalledProcessError
+
+        If any task returns a non-zero exit code, CalledProcessError is raised for the failed task
+        with the lowest task number, after all the tasks complete.
+        """
+        # Never start more workers than there are tasks
+        workers = max(1, min(num_tasks, max_processes))
+        results = []
+        with open(array_file) as f:
+            # Stream and tokenize the array file here, so the workers receive ready to run argument lists.
+            # The parameters on each line are passed to bash as positional parameters, exactly like the
+            # xargs backend does, with the task number in $0.
+            # The log file names only differ by the task number suffix.  The command is tokenized once.
+            log_prefix = log_file + "-"
+            arg_templates = _compile_args(words) if words is not None and not self.reuse_shell else None
+            run_task = self._run_shell_task if self.reuse_shell else _run_array_task
+
+            def make_task(task_num, line):
+                task_id = str(task_num)
+                try:
+                    params = _split_array_line(line)
+                except ValueError as e:
+                    # Like the xargs backend, a line which cannot be parsed fails its task
+                    sys.stderr.write("jobrunner: task %i: %s\n" % (task_num, e))
+                    results.append((task_num, 1))
+                    return None
+                if self.reuse_shell:
+                    # The parameters are assigned with set, because $0 cannot be changed in a running shell
+                    log = log_prefix + task_id
+                    command_line = "set -- %s\n{ %s\n} > %s 2>&1" % (" ".join(shlex.quote(param) for param in params), script, shlex.quote(log))
+                    return task_num, command_line, log, quiet
+                if arg_templates is not None and not any(_SPLIT_OR_GLOB_RE.search(param) for param in params):
+                    args = _substitute_args(arg_templates, params)
+                else:
+                    args = [_BASH, "-c", script, task_id]
+                    args.extend(params)
+                return task_num, args, log_prefix + task_id, quiet
+
+            tasks = (make_task(task_num, line) for task_num, line in enumerate(itertools.islice(f, num_tasks), 1))
+            tasks = (task for task in tasks if task is not None)
+
+            if workers == 1:
+                # Run the tasks one after another directly, without starting a pool
+                for task in tasks:
+                    results.append(run_task(task))
             else:
-                compute_node_command = "qarrayrun " + self.subtask_env_var_name + ' ' + array_file + ' ' + command_line
+                with self._pool_lock:
+                    pool = self._get_pool(workers)
+                    pending = set()
+                    for task in tasks:
+                        if len(pending) >= 2 * workers:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            results.extend(future.result() for future in done)
+                        pending.add(pool.submit(run_task, task))
+                    results.extend(future.result() for future in wait(pending)[0])
+
+        failures = sorted((task_num, return_code) for task_num, return_code in results if return_code != 0)
+        if failures:
+            task_num, return_code = failures[0]
+            raise subprocess.CalledProcessError(return_code, "task %i: %s" % (task_num, script))
+
+    def _run_shell_task(self, task):
+        """Run one task of a local array job in an idle reusable bash shell.
+
+        A new shell is started when all the shells are busy, so there are never more shells than
+        worker threads.  The shell is returned to the idle shells when the task completes.
 
-            compute_node_command = "'" + compute_node_command + "'"
+        Parameters
+        ----------
+        task : tuple of (int, str, str, bool)
+            Task number, bash command line redirecting its output to the log file, log file of the
+            task, and quiet flag.  Unless quiet is true, the log file is copied to stdout after the
+            task completes.  A log file which the shell could not create fails the task with exit
+            status 1, and nothing is copied.
 
-            if self.hpc_type == "slurm":
-                compute_node_command = "'#!/bin/sh\\n'" + compute_node_command
+        Returns
+        -------
+        task_num : int
+            Task number.
+        return_code : int
+            Exit status of the command.
+        """
+        task_num, command_line, log_file, quiet = task
+        try:
+            shell = self._shells.get_nowait()
+        except queue.Empty:
+            shell = _BashCoprocess()
+        return_code = shell.run(command_line)
+        self._shells.put(shell)
+        if not quiet:
+            _copy_log_to_stdout(log_file)
+            _stdout_buffer.flush()
+        return task_num, return_code
+
+    def _write_commands_file(self, command_line, array_file, num_tasks, array_subshell):
+        """Write the command of each sub-task of an array job, with the parameters already substituted, to a file.
 
-            shell_command_line = "echo -e " + compute_node_command + " | " + qsub_command_line
+        Parameters
+        ----------
+        command_line : str
+            Command with parameter placeholders of the form {1}, {2}, {3} ...
+        array_file : str
+            Name of the file containing the arguments for each sub-task with one line per sub-task.
+        num_tasks : int
+            Number of lines of the array file to process.
+        array_subshell : bool
+            When false, the substituted commands are split into arguments and re-quoted, so the
+            shell on the compute node executes them without further expansion, like qarrayrun does.
 
-            if self.verbose:
-                print(shell_command_line)
-
-            job_id = subprocess.check_output(shell_command_line, shell=True)  # If the return code is non-zero it raises a CalledProcessError
-            if sys.version_info > (3,):
-                job_id = job_id.decode(std_encoding)  # Python 3 stdout is bytes, not str
-            job_id = job_id.strip()
-            if self.strip_job_array_suffix:
-                dot_idx = job_id.find('.')
-                if dot_idx > 0:
-                    job_id = job_id[0: dot_idx]
-            if self.verbose:
-                print("Job id=" + job_id)
-            return job_id
+        Returns
+        -------
+        commands_file : str
+            Path of the new file, in the same directory as the array_file, with one command per line.
+
+        Examples
+        --------
+        >>> from tempfile import NamedTemporaryFile
+        >>> fout = NamedTemporaryFile(delete=False, mode='w'); _ = fout.write("a b\\nc d*\\n"); fout.close()
+        >>> runner = JobRunner("slurm")
+        >>> commands_file = runner._write_commands_file("cmd {2} {1}", fout.name, 2, False)
+        >>> print(open(commands_file).read().strip())
+        cmd b a
+        cmd 'd*' c
+        >>> os.unlink(commands_file); os.unlink(fout.name)
+        """
+        array_dir = os.path.dirname(os.path.abspath(array_file))
+        fd, commands_file = tempfile.mkstemp(prefix=os.path.basename(array_file) + '-', suffix=".commands", dir=array_dir)
+        with open(array_file) as f, os.fdopen(fd, 'w') as fout:
+            for line in itertools.islice(f, num_tasks):
+                command = _substitute_arguments(command_line, line.split())
+                if not array_subshell:
+                    command = ' '.join(shlex.quote(arg) for arg in shlex.split(command))
+                fout.write(command + '\n')
+        return commands_file
+
+    def _run_array_batched(self, command_line, exports, array_file, num_tasks, max_processes, log_file, quiet):
+        """Run the tasks of a local array job in slices, with one bash process per slice.
+
+        Parameters
+        ----------
+        command_line : str
+            Command executed for each task, with the array file parameters in $1, $2, ...
+        exports : str
+            Shell commands setting up the environment of the tasks, created by _math_thread_exports().
+        array_file : str
+            Name of the file containing the arguments for each task with one line per task.
+        num_tasks : int
+            Number of lines of the array file to process.
+        max_processes : int
+            Maximum number of slices executing concurrently, which is also the number of slices.
+        log_file : str
+            Path to the log file of the tasks, to be suffixed with the task number.
+        quiet : bool
+            When false, the log files are copied to stdout as each slice completes.
+
+        Raises
+        ------
+        CalledProcessError
+
+        If any task returns a non-zero exit code, CalledProcessError is raised for the failed task
+        with the lowest task number, after all the tasks complete.
+        """
+        workers = max(1, min(num_tasks, max_processes))
+        slice_size = (num_tasks + workers - 1) // workers
+        log_prefix = log_file + "-"
+        slices = []
+        with open(array_file) as f:
+            lines = enumerate(itertools.islice(f, num_tasks), 1)
+            while True:
+                chunk = list(itertools.islice(lines, slice_size))
+                if not chunk:
+                    break
+                script = [exports + "set -o pipefail"]
+                task_nums = []
+                log_files = []
+                for task_num, line in chunk:
+                    task_log_file = log_prefix + str(task_num)
+                    try:
+                        params = _split_array_line(line)
+                    except ValueError as e:
+                        # Like the xargs backend, a line which cannot be parsed fails its task
+                        script.append("echo %s >&2; echo %i 1" % (shlex.quote("jobrunner: task %i: %s" % (task_num, e)), task_num))
+                        task_nums.append(task_num)
+                        continue
+                    script.append("set -- " + ' '.join(shlex.quote(param) for param in params))
+                    script.append("(" + command_line + ") > " + shlex.quote(task_log_file) + " 2>&1; echo %i $?" % task_num)
+                    task_nums.append(task_num)
+                    log_files.append(task_log_file)
+                slices.append(('\n'.join(script) + '\n', task_nums, log_files, quiet))
+
+        if len(slices) <= 1:
+            results = [result for task in slices for result in _run_array_slice(task)]
+        else:
+            with self._pool_lock:
+                pool = self._get_pool(len(slices))
+                results = [result for slice_results in pool.map(_run_array_slice, slices) for result in slice_results]
+
+        failures = sorted((task_num, return_code) for task_num, return_code in results if return_code != 0)
+        if failures:
+            task_num, return_code = failures[0]
+            raise subprocess.CalledProcessError(return_code, "task %i: %s" % (task_num, command_line))
+
+    def _get_pool(self, workers):
+        """Return the worker pool of the pool backend, reusing the pool of the previous array job when possible.
+
+        Each worker thread supervises one task process at a time, so the number of workers is the
+        number of tasks running concurrently.  The pool is only reused when the number of workers is
+        unchanged.  Must be called with _pool_lock held.
+
+        Parameters
+        ----------
+        workers : int
+            Number of worker threads.
+
+        Returns
+        -------
+        pool : concurrent.futures.ThreadPoolExecutor
+            Worker pool.
+        """
+        if self._pool is not None and self._pool_workers != workers:
+            self._close_pool()
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+            self._pool_workers = workers
+        return self._pool
+
+    def _close_pool(self):
+        """Stop the worker pool of the pool backend, if any."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_workers = None
+
+    def _make_chunk_loop(self, compute_node_command, chunk_size, num_tasks):
+        """Wrap an array job command in a loop over the lines of one chunk of the array file.
+
+        The loop runs in sh regardless of the login shell of the compute node.  The line number
+        of each iteration is passed to the command in the JOBRUNNER_TASK_ID environment variable.
+        The loop exits with the status of the last failing line, if any.
+
+        Parameters
+        ----------
+        compute_node_command : str
+            Command executed for each line of the chunk.
+        chunk_size : int
+            Number of lines in each chunk.
+        num_tasks : int
+            Total number of lines to process.
+
+        Returns
+        -------
+        compute_node_command : str
+            Command processing all the lines of the chunk selected by the array job sub-task number.
+
+        Examples
+        --------
+        >>> runner = JobRunner("slurm")
+        >>> print(runner._make_chunk_loop("qarrayrun JOBRUNNER_TASK_ID file cmd", 10, 25))
+        sh -c 'status=0; i=$(( ($SLURM_ARRAY_TASK_ID - 1) * 10 + 1 )); last=$(( $SLURM_ARRAY_TASK_ID * 10 )); if [ $last -gt 25 ]; then last=25; fi; while [ $i -le $last ]; do JOBRUNNER_TASK_ID=$i qarrayrun JOBRUNNER_TASK_ID file cmd || status=$?; i=$(( $i + 1 )); done; exit $status'
+        """
+        task_id = "$" + self.subtask_env_var_name
+        loop = "status=0; "
+        loop += "i=$(( (%s - 1) * %i + 1 )); " % (task_id, chunk_size)
+        loop += "last=$(( %s * %i )); " % (task_id, chunk_size)
+        loop += "if [ $last -gt %i ]; then last=%i; fi; " % (num_tasks, num_tasks)
+        loop += "while [ $i -le $last ]; do JOBRUNNER_TASK_ID=$i " + compute_node_command + " || status=$?; i=$(( $i + 1 )); done; "
+        loop += "exit $status"
+        return "sh -c " + shlex.quote(loop)
+
+    def poll_status(self, job_ids):
+        """Query the state of several jobs with a single job scheduler command.
+
+        Querying the job scheduler once for all the jobs, instead of once per job, reduces the
+        load on the job scheduler when a program monitors many jobs.
+
+        Parameters
+        ----------
+        job_ids : str or list of str
+            Single job id or list of job ids returned by run() or run_array().
+
+        Returns
+        -------
+        states : dict of str to str
+            State of each job, one of "PENDING", "RUNNING", "COMPLETED", "FAILED", or "UNKNOWN".
+            The state of an array job combines the states of its sub-tasks: it is "FAILED" if any
+            sub-task failed, otherwise "RUNNING" if any sub-task is running, and so on.  Jobs no
+            longer known to the job scheduler are "UNKNOWN".  Grid engine does not report finished
+            jobs, so they are always "UNKNOWN".
+
+        Examples
+        --------
+        >>> runner = JobRunner("local")
+        >>> runner.poll_status(["0"])
+        Traceback (most recent call last):
+        ValueError: poll_status() does not support hpc type local
+        """
+        if self._builder is None:
+            raise ValueError("poll_status() does not support hpc type %s" % self.hpc_type)
+        if isinstance(job_ids, str):
+            job_ids = [job_ids]
+        if len(job_ids) == 0:
+            return dict()
+
+        # The status commands exit with an error when some jobs are unknown, but still report the others
+        process = subprocess.Popen(self._builder.status_args(job_ids), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output, _ = process.communicate()
+        return self._builder.parse_status(_decode_bytes(output), job_ids)
+
+    def close(self):
+        """Release the background resources held by this JobRunner.
+
+        The reusable bash shells are terminated, the worker pool of the pool backend is stopped, and the
+        run_async() thread pool is shut down after the pending job submissions complete.  The JobRunner
+        can still be used after calling close().
+        """
+        with self._pool_lock:
+            self._close_pool()
+        while not self._shells.empty():
+            self._shells.get_nowait().close()
+        if self._bash is not None:
+            self._bash.close()
+            self._bash = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __del__(self):
+        if getattr(self, "_bash", None) is not None:
+            self._bash.close()
+
+    def run_many(self, commands, job_name, log_file, template=None, array_file=None, **kwargs):
+        """Run a batch of commands as a single array job.
+
+        Submitting one array job instead of one job per command replaces N scheduler submissions
+        with a single submission.  The commands are written to an array file, one per line, and
+        the array job is started with run_array().  Without a template, each grid, slurm, or torque
+        sub-task extracts its command from the array file with sed and evaluates it exactly as written.
+
+        Parameters
+        ----------
+        commands : list of str or list of list of str
+            When template is None, each item is a complete command line to be executed.
+            When template is specified, each item is the list of arguments (or a single
+            whitespace-separated string of arguments) substituted into the template.  The arguments
+            are split on whitespace like qarrayrun does, so an argument in a list cannot contain
+            whitespace.
+        job_name : str
+            Job name that will appear in the job scheduler queue.
+        log_file : str
+            Path to the combined stdout / stderr log file.  The sub-task number will be automatically appended.
+        template : str, optional defaults to None
+            Command to be executed with parameter placeholders of the form {1}, {2}, {3} ...
+            Use this when all the commands are identical except for their arguments.
+        array_file : str, optional defaults to None
+            Path of the array file to create.  If not specified, a uniquely named file is created
+            in the directory of the log file, which must be accessible to the compute nodes.
+            The file is not removed after the job is submitted.
+        kwargs : optional
+            Additional keyword arguments passed to run_array().
+
+        Returns
+        -------
+        job_id : str
+            Grid or torque job id.  Returns '0' in local mode.
+        num_tasks : int
+            Number of sub-tasks in the array job.  Sub-task i runs the i-th command.
+
+        Raises
+        ------
+        JobRunnerException
+
+        If the list of commands is empty, or any command is empty or blank, JobRunnerException is raised.
+
+        ValueError
+
+        If a command contains a newline, or an argument in a list of arguments is empty or contains
+        whitespace, ValueError is raised.
+
+        Examples
+        --------
+        >>> from tempfile import mkdtemp
+        >>> log_dir = mkdtemp()
+        >>> runner = JobRunner("local")
+        >>> runner.run_many(["echo one", "echo 'two  spaces' | tr a-z A-Z"], "JobName", os.path.join(log_dir, "log"), quiet=True)
+        ('0', 2)
+        >>> f = open(os.path.join(log_dir, "log-2")); print(f.read().strip()); f.close()
+        TWO  SPACES
+        """
+        for row in commands:
+            if isinstance(row, (list, tuple)) and any(len(arg.split()) != 1 for arg in row):
+                raise ValueError("Array job arguments cannot be empty or contain whitespace: %s" % (row,))
+
+        # Surrounding whitespace is removed: xargs would join a line ending with a blank to the next line
+        rows = [(' '.join(row) if isinstance(row, (list, tuple)) else row).strip() for row in commands]
+        if len(rows) == 0:
+            raise JobRunnerException("There are no commands to run.\nCannot start array job %s." % job_name)
+        for row in rows:
+            if '\n' in row:
+                raise ValueError("Array job commands cannot contain newlines: %s" % row)
+            if not row:
+                raise JobRunnerException("Array job commands cannot be empty.\nCannot start array job %s." % job_name)
+
+        if template:
+            command_line = template
+        elif self.hpc_type == "local":
+            # xargs removes the backslash escapes, leaving the whole command in $1 for eval
+            rows = [re.sub(r"(\W)", r"\\\1", row) for row in rows]
+            command_line = 'eval "{1}"'
+
+        if array_file is None:
+            log_dir = os.path.dirname(os.path.abspath(log_file))
+            fd, array_file = tempfile.mkstemp(prefix=job_name + '-', suffix=".array", dir=log_dir)
+            os.close(fd)
+        with open(array_file, 'w') as f:
+            for row in rows:
+                f.write(row + '\n')
+
+        num_tasks = len(rows)
+        if template or self.hpc_type == "local":
+            kwargs["num_tasks"] = num_tasks
+            job_id = self.run_array(command_line, job_name, log_file, array_file, **kwargs)
+        else:
+            # The array file is the commands file: each sub-task evaluates its command exactly as written
+            for name in ("num_tasks", "array_subshell", "quiet", "pre_substitute", "batch"):
+                kwargs.pop(name, None)
+            log_file = self._builder.format_log_suffix(log_file)
+            job_id = self._submit_array(functools.partial(_sed_dispatch_command, array_file), job_name, log_file, num_tasks, **kwargs)
+        return job_id, num_tasks
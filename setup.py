@@ -15,7 +15,6 @@ with open('HISTORY.rst') as history_file:
     history = history_file.read().replace('.. :changelog:', '')
 
 requirements = [
-    'psutil',
     'qarrayrun',
 ]
 
@@ -38,6 +37,7 @@ setup(
                  'jobrunner'},
     include_package_data=True,
     install_requires=requirements,
+    python_requires='>=3.4',
     license="BSD",
     zip_safe=False,
     keywords=['bioinformatics', 'NGS', 'jobrunner'],
@@ -46,9 +46,8 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
@@ -7,17 +7,24 @@ test_jobrunner
 Tests for `jobrunner` module.
 """
 
-from jobrunner import JobRunner
+import errno
+import os
+import pytest
+import subprocess
+import time
 
+from jobrunner import JobRunner, JobRunnerException
 
-def test_arrayjob(tmpdir):
+
+@pytest.mark.parametrize("local_backend", ["xargs", "pool"])
+def test_arrayjob(local_backend, tmpdir):
     """Verify array jobs have multiple processes, separate log files for each task, and support parameter substitution..
     """
     array_file_path = tmpdir.join("array_file")
     array_file_path.write("World 1\nWorld 2\nWorld 3\n")
     log_file_path = tmpdir.join("logfile.log")
 
-    runner = JobRunner("local")
+    runner = JobRunner("local", local_backend=local_backend)
     runner.run_array("echo Hello {1} {2}", "JobName", str(log_file_path), str(array_file_path))
 
     assert(tmpdir.join("logfile.log-1").read() == "Hello World 1\n")
@@ -40,6 +47,70 @@ def test_noisy_run(tmpdir, capfd):
     assert(len(captured.err) == 0)
 
 
+def test_noisy_run_large_output(tmpdir, capfd):
+    """Verify all the output of a chatty job reaches both stdout and the logfile.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local")
+    runner.run("seq 100000; echo done 1>&2", "JobName", str(log_file_path), quiet=False)
+    captured = capfd.readouterr()
+
+    expected = ''.join("%i\n" % i for i in range(1, 100001)) + "done\n"
+    assert(tmpdir.join("logfile.log").read() == expected)
+    assert(captured.out == expected)
+
+
+def test_noisy_run_devnull_log(capfd):
+    """Verify a job logging to /dev/null without quiet mode still writes its output to stdout.
+    """
+    runner = JobRunner("local")
+    runner.run("(echo text to stdout; echo text to stderr 1>&2)", "JobName", os.devnull, quiet=False)
+    captured = capfd.readouterr()
+    assert(captured.out == "text to stdout\ntext to stderr\n")
+
+
+def test_noisy_run_pipe_log(capfd):
+    """Verify a job can log to a pipe without quiet mode.
+    """
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd) as f:
+        try:
+            runner = JobRunner("local")
+            runner.run("(echo text to stdout; echo text to stderr 1>&2)", "JobName", "/proc/self/fd/%i" % write_fd, quiet=False)
+        finally:
+            os.close(write_fd)
+        log = f.read()
+    captured = capfd.readouterr()
+    assert(log == "text to stdout\ntext to stderr\n")
+    assert(captured.out == "text to stdout\ntext to stderr\n")
+
+
+@pytest.mark.parametrize("quiet", [False, True])
+def test_run_bad_log_file(quiet, tmpdir, capfd):
+    """Verify a log file which cannot be opened fails the job through the exception handler.
+    """
+    log_file_path = tmpdir.join("missing_dir", "logfile.log")
+    exceptions = []
+
+    def handler(exc_type, exc_value, exc_traceback):
+        exceptions.append(exc_value)
+
+    runner = JobRunner("local", exception_handler=handler)
+    runner.run("echo text", "JobName", str(log_file_path), quiet=quiet)
+    assert(len(exceptions) == 1)
+    assert(isinstance(exceptions[0], subprocess.CalledProcessError))
+    assert(str(log_file_path) in capfd.readouterr().err)
+
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    runner = JobRunner("local", local_backend="pool", exception_handler=handler)
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path), quiet=quiet)
+    assert(len(exceptions) == 2)
+    assert(isinstance(exceptions[1], subprocess.CalledProcessError))
+    runner.close()
+
+
 def test_quiet_run(tmpdir, capfd):
     """Verify NO tee output to stdout when not in quiet mode, and logfile captures all.
     """
@@ -54,14 +125,31 @@ def test_quiet_run(tmpdir, capfd):
     assert(len(captured.err) == 0)
 
 
-def test_noisy_array_run(tmpdir, capfd):
+@pytest.mark.parametrize("reuse_shell", [False, True])
+@pytest.mark.parametrize("log_file", [os.devnull, None, ""])
+def test_quiet_run_discard(log_file, reuse_shell, capfd):
+    """Verify quiet mode discards the output without a log file, and still reports failures.
+    """
+    runner = JobRunner("local", reuse_shell=reuse_shell)
+    runner.run("(echo text to stdout; echo text to stderr 1>&2)", "JobName", log_file, quiet=True)
+    captured = capfd.readouterr()
+    assert(len(captured.out) == 0)
+    assert(len(captured.err) == 0)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.run("exit 3", "JobName", log_file, quiet=True)
+    runner.close()
+
+
+@pytest.mark.parametrize("local_backend", ["xargs", "pool"])
+def test_noisy_array_run(local_backend, tmpdir, capfd):
     """Verify tee output to stdout when not in quiet mode, and logfile captures all.
     """
     array_file_path = tmpdir.join("array_file")
     array_file_path.write("text\n")
     log_file_path = tmpdir.join("logfile.log")
 
-    runner = JobRunner("local")
+    runner = JobRunner("local", local_backend=local_backend)
     runner.run_array("(echo {1} to stdout; echo {1} to stderr 1>&2)", "JobName", str(log_file_path), str(array_file_path), quiet=False)
     captured = capfd.readouterr()
 
@@ -71,17 +159,433 @@ def test_noisy_array_run(tmpdir, capfd):
     assert(len(captured.err) == 0)
 
 
-def test_quiet_array_run(tmpdir, capfd):
+@pytest.mark.parametrize("local_backend", ["xargs", "pool"])
+def test_quiet_array_run(local_backend, tmpdir, capfd):
     """Verify NO tee output to stdout when not in quiet mode, and logfile captures all.
     """
     array_file_path = tmpdir.join("array_file")
     array_file_path.write("text\n")
     log_file_path = tmpdir.join("logfile.log")
 
-    runner = JobRunner("local")
+    runner = JobRunner("local", local_backend=local_backend)
     runner.run_array("(echo {1} to stdout; echo {1} to stderr 1>&2)", "JobName", str(log_file_path), str(array_file_path), quiet=True)
     captured = capfd.readouterr()
 
     assert(tmpdir.join("logfile.log-1").read() == 'text to stdout\ntext to stderr\n')
     assert(len(captured.out) == 0)
     assert(len(captured.err) == 0)
+
+
+def test_reuse_shell_run(tmpdir, capfd):
+    """Verify a reused shell isolates the jobs, tees the output, and reports failures.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", reuse_shell=True)
+    runner.run("(cd /; export FOO=foo; echo text to stdout; echo text to stderr 1>&2)", "JobName", str(log_file_path))
+    runner.run("echo $PWD ${FOO:-unset}", "JobName", str(log_file_path), quiet=True)
+    captured = capfd.readouterr()
+
+    assert(tmpdir.join("logfile.log").read() == os.getcwd() + " unset\n")
+    assert(captured.out == "text to stdout\ntext to stderr\n")
+    assert(len(captured.err) == 0)
+
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        runner.run("exit 100", "JobName", str(log_file_path))
+    assert(exc_info.value.returncode == 100)
+    runner.close()
+
+
+def test_reuse_shell_partial_stderr_line(tmpdir, capfd):
+    """Verify a job whose stderr ends without a newline does not hang the reused shell, and its stderr is unchanged.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", reuse_shell=True)
+    runner.run("printf foo 1>&2; true", "JobName", str(log_file_path), quiet=True)
+    runner.run("printf 'bar\\n\\n' 1>&2; true", "JobName", str(log_file_path), quiet=True)
+    captured = capfd.readouterr()
+    assert(captured.err == "foobar\n\n")
+    runner.close()
+
+
+def test_pool_array_failure(tmpdir):
+    """Verify the pool backend runs every task and reports the exit status of the first failed task.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("0\n3\n4\n0\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool")
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        runner.run_array("(echo {1}; exit {1})", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+
+    assert(exc_info.value.returncode == 3)
+    assert(tmpdir.join("logfile.log-4").read() == "0\n")
+
+
+def test_pool_reused(tmpdir):
+    """Verify the pool backend reuses its worker pool across array jobs, until closed.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool")
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+    pool = runner._pool
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+    assert(runner._pool is pool)
+    assert(tmpdir.join("logfile.log-2").read() == "2\n")
+
+    runner.close()
+    assert(runner._pool is None)
+
+
+def test_pool_single_task(tmpdir):
+    """Verify a single task array job runs without starting a worker pool.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("World\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool", max_workers=2)
+    runner.run_array("echo Hello {1}", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+    assert(runner._pool is None)
+    assert(tmpdir.join("logfile.log-1").read() == "Hello World\n")
+
+
+def test_pool_plain_command_params(tmpdir):
+    """Verify plain commands executed without bash still split and expand parameters like bash.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("'two  words' x\nplain\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool")
+    runner.run_array("env echo {1} {2} {3}", "JobName", str(log_file_path), str(array_file_path))
+
+    assert(tmpdir.join("logfile.log-1").read() == "two words x\n")
+    assert(tmpdir.join("logfile.log-2").read() == "plain\n")
+
+
+def test_builtin_run(tmpdir):
+    """Verify commands starting with a bash builtin run the builtin rather than an executable of the same name.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local")
+    runner.run("echo --version", "JobName", str(log_file_path), quiet=True)
+    assert(tmpdir.join("logfile.log").read() == "--version\n")
+
+
+def test_pool_reuse_shell(tmpdir, capfd):
+    """Verify the pool backend feeds the array tasks to reusable shells and reports failures.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2 'a b'\n3\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool", reuse_shell=True, max_workers=2)
+    runner.run_array("echo task {1} {2}; echo {1} to stderr 1>&2", "JobName", str(log_file_path), str(array_file_path))
+    captured = capfd.readouterr()
+    assert(tmpdir.join("logfile.log-2").read() == "task 2 a b\n2 to stderr\n")
+    assert("task 3\n3 to stderr\n" in captured.out)
+    assert(runner._shells.qsize() <= 2)
+
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        runner.run_array("exit $(( {1} % 3 ))", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+    assert(exc_info.value.returncode == 1)
+    assert("task 1" in str(exc_info.value))
+
+    runner.close()
+    assert(runner._shells.empty())
+
+
+@pytest.mark.parametrize("local_backend", ["xargs", "pool"])
+def test_batch_array_run(local_backend, tmpdir, capfd):
+    """Verify batched array jobs write one log file per task, copy them to stdout, and report failures.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2 'a b'\n3\n4\n5\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend=local_backend)
+    runner.run_array("echo task {1} {2}; echo {1} to stderr 1>&2", "JobName", str(log_file_path), str(array_file_path), max_processes=2, batch=True)
+    captured = capfd.readouterr()
+
+    assert(tmpdir.join("logfile.log-2").read() == "task 2 a b\n2 to stderr\n")
+    assert(tmpdir.join("logfile.log-5").read() == "task 5\n5 to stderr\n")
+    assert("task 3\n3 to stderr\n" in captured.out)
+
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        runner.run_array("exit $(( {1} % 3 ))", "JobName", str(log_file_path), str(array_file_path), max_processes=2, batch=True, quiet=True)
+    assert(exc_info.value.returncode == 1)
+    assert("task 1" in str(exc_info.value))
+
+
+def test_batch_array_run_sendfile_unsupported(tmpdir, capfd, monkeypatch):
+    """Verify the task logs are still copied to stdout when sendfile only supports sockets, like on macOS.
+    """
+    def sendfile(out_fd, in_fd, offset, count):
+        raise OSError(errno.ENOTSOCK, os.strerror(errno.ENOTSOCK))
+
+    monkeypatch.setattr(os, "sendfile", sendfile)
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", local_backend="pool")
+    runner.run_array("echo task {1}", "JobName", str(log_file_path), str(array_file_path), batch=True, max_processes=1)
+    assert(capfd.readouterr().out == "task 1\ntask 2\n")
+
+
+@pytest.mark.parametrize("reuse_shell", [False, True])
+def test_batch_array_run_bad_log_file(reuse_shell, tmpdir):
+    """Verify a batched array job whose log files cannot be created fails through the exception handler.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    log_file_path = tmpdir.join("missing_dir", "logfile.log")
+    exceptions = []
+
+    def handler(exc_type, exc_value, exc_traceback):
+        exceptions.append(exc_value)
+
+    runner = JobRunner("local", local_backend="pool", reuse_shell=reuse_shell, exception_handler=handler)
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path), batch=True)
+    runner.close()
+    assert(len(exceptions) == 1)
+    assert(isinstance(exceptions[0], subprocess.CalledProcessError))
+
+
+def test_pool_reuse_shell_bad_log_file(tmpdir):
+    """Verify pool tasks fed to reusable shells fail through the exception handler when their log files cannot be created.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    log_file_path = tmpdir.join("missing_dir", "logfile.log")
+    exceptions = []
+
+    def handler(exc_type, exc_value, exc_traceback):
+        exceptions.append(exc_value)
+
+    runner = JobRunner("local", local_backend="pool", reuse_shell=True, max_workers=2, exception_handler=handler)
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path))
+    runner.close()
+    assert(len(exceptions) == 1)
+    assert(isinstance(exceptions[0], subprocess.CalledProcessError))
+
+
+@pytest.mark.parametrize("local_backend,batch", [("xargs", False), ("pool", False), ("pool", True)])
+def test_array_run_stdin(local_backend, batch, tmpdir):
+    """Verify the array tasks do not read the standard input of the calling process.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"parent stdin\n")
+    os.close(write_fd)
+    saved_stdin = os.dup(0)
+    os.dup2(read_fd, 0)
+    os.close(read_fd)
+    try:
+        runner = JobRunner("local", local_backend=local_backend)
+        runner.run_array("cat", "JobName", str(log_file_path), str(array_file_path), quiet=True, batch=batch)
+        runner.close()
+    finally:
+        os.dup2(saved_stdin, 0)
+        os.close(saved_stdin)
+    assert(tmpdir.join("logfile.log-1").read() == "")
+    assert(tmpdir.join("logfile.log-2").read() == "")
+
+
+@pytest.mark.parametrize("local_backend,reuse_shell,batch", [("xargs", False, False), ("pool", False, False), ("pool", True, False), ("pool", False, True)])
+def test_array_run_unbalanced_quote(local_backend, reuse_shell, batch, tmpdir, capfd):
+    """Verify an array file line with an unbalanced quote fails its task through the exception handler.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("a\nO'Brien\nc\n")
+    log_file_path = tmpdir.join("logfile.log")
+    exceptions = []
+
+    def handler(exc_type, exc_value, exc_traceback):
+        exceptions.append(exc_value)
+
+    runner = JobRunner("local", local_backend=local_backend, reuse_shell=reuse_shell, exception_handler=handler)
+    runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path), quiet=True, batch=batch)
+    runner.close()
+    assert(len(exceptions) == 1)
+    assert(isinstance(exceptions[0], subprocess.CalledProcessError))
+    if local_backend == "pool":
+        assert("task 2" in str(exceptions[0]))
+        assert(tmpdir.join("logfile.log-3").read() == "c\n")
+        assert("task 2" in capfd.readouterr().err)
+
+
+@pytest.mark.parametrize("local_backend", ["xargs", "pool"])
+def test_local_run_many(local_backend, tmpdir):
+    """Verify each local run_many() sub-task runs its own command, with quotes, dollars, and trailing whitespace.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+    commands = ["echo one", "echo 'two  spaces' \"$HOME\" | tr a-z A-Z", "echo trailing   ", "echo h\u00e9llo w\u00f6rld", "x=5; echo $x"]
+
+    runner = JobRunner("local", local_backend=local_backend)
+    assert(runner.run_many(commands, "JobName", str(log_file_path), quiet=True) == ('0', 5))
+    assert(tmpdir.join("logfile.log-2").read() == "TWO  SPACES " + os.environ["HOME"].upper() + "\n")
+    assert(tmpdir.join("logfile.log-3").read() == "trailing\n")
+    assert(tmpdir.join("logfile.log-4").read_text("utf-8") == "h\u00e9llo w\u00f6rld\n")
+    assert(tmpdir.join("logfile.log-5").read() == "5\n")
+
+    with pytest.raises(JobRunnerException):
+        runner.run_many(["echo one", "  "], "JobName", str(log_file_path), quiet=True)
+
+
+def test_run_many_template_arguments(tmpdir):
+    """Verify run_many() substitutes lists of arguments into the template, and rejects arguments with whitespace.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local")
+    runner.run_many([["a", "b"], "c d"], "JobName", str(log_file_path), template="echo {2} {1}", quiet=True)
+    assert(tmpdir.join("logfile.log-1").read() == "b a\n")
+    assert(tmpdir.join("logfile.log-2").read() == "d c\n")
+
+    with pytest.raises(ValueError):
+        runner.run_many([["a b", "c"]], "JobName", str(log_file_path), template="echo {1}", quiet=True)
+
+
+def test_pin_math_threads(tmpdir, monkeypatch):
+    """Verify the numerical library thread pools are limited to the requested threads unless already configured.
+    """
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    monkeypatch.setenv("MKL_NUM_THREADS", "7")
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("local", pin_math_threads=True)
+    runner.run("echo $OMP_NUM_THREADS $MKL_NUM_THREADS", "JobName", str(log_file_path), threads=4, quiet=True)
+    runner.run_array("echo $OMP_NUM_THREADS $MKL_NUM_THREADS", "JobName", str(log_file_path), str(array_file_path), quiet=True)
+
+    assert(tmpdir.join("logfile.log").read() == "4 7\n")
+    assert(tmpdir.join("logfile.log-1").read() == "1 7\n")
+
+
+@pytest.fixture
+def fake_scheduler(tmpdir, monkeypatch):
+    """Put fake sbatch and qsub commands on the PATH.
+
+    Each command saves its arguments, one per line, to <command>.args and the job script it reads
+    from stdin to <command>.script in the returned directory, then prints the job id in the
+    JOB_ID environment variable, 123 by default.
+    """
+    bin_dir = tmpdir.mkdir("fake_bin")
+    for command in ("sbatch", "qsub"):
+        script = bin_dir.join(command)
+        script.write("#!/bin/bash\n"
+                     "printf '%%s\\n' \"$@\" > %s/%s.args\n"
+                     "cat > %s/%s.script\n"
+                     "echo ${JOB_ID:-123}\n" % (bin_dir, command, bin_dir, command))
+        script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    return bin_dir
+
+
+def test_run_many_hpc_commands_unchanged(tmpdir, fake_scheduler):
+    """Verify the HPC sub-tasks of run_many() execute their commands exactly as written.
+    """
+    array_file_path = tmpdir.join("commands")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("slurm")
+    job_id, num_tasks = runner.run_many(['echo  "a  b"', "echo two"], "JobName", str(log_file_path), array_file=str(array_file_path))
+    assert(job_id == "123")
+    assert(num_tasks == 2)
+    assert("--array=1-2" in fake_scheduler.join("sbatch.args").read().split("\n"))
+
+    compute_node_command = fake_scheduler.join("sbatch.script").read().split("\n")[1]
+    env = dict(os.environ, SLURM_ARRAY_TASK_ID="1")
+    output = subprocess.check_output(compute_node_command, shell=True, env=env)
+    assert(output == b"a  b\n")
+
+
+def test_slurm_run(tmpdir, fake_scheduler, monkeypatch):
+    """Verify a slurm job script is fed to sbatch on stdin with a shebang line, and the job id is decoded.
+    """
+    monkeypatch.setenv("JOB_ID", " 456 ")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("slurm")
+    job_id = runner.run("echo 'Hello  World' > out.txt", "JobName", str(log_file_path), wait_for=["1", "2"])
+    assert(job_id == "456")
+    args = fake_scheduler.join("sbatch.args").read().splitlines()
+    assert(args == ["--parsable", "--export=ALL", "--job-name=JobName", "-o", str(log_file_path), "--dependency=afterok:1:2"])
+    assert(fake_scheduler.join("sbatch.script").read() == "#!/bin/sh\necho 'Hello  World' > out.txt\n")
+
+
+@pytest.mark.parametrize("hpc_type,job_id,stripped_job_id", [("grid", "789.1-3:1", "789"), ("torque", "123[].server", "123[]")])
+def test_qsub_array_run(hpc_type, job_id, stripped_job_id, tmpdir, fake_scheduler, monkeypatch):
+    """Verify the log file sub-task suffix reaches qsub unexpanded, and the array job id suffix is stripped.
+    """
+    monkeypatch.setenv("JOB_ID", job_id)
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("a\nb\nc\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner(hpc_type, strip_job_array_suffix=True)
+    assert(runner.run_array("echo {1}", "JobName", str(log_file_path), str(array_file_path)) == stripped_job_id)
+    args = fake_scheduler.join("qsub.args").read().splitlines()
+    assert(args[args.index("-t") + 1] == "1-3")
+    expected_log = str(log_file_path) + "-$TASK_ID" if hpc_type == "grid" else str(log_file_path)
+    assert(args[args.index("-o") + 1] == expected_log)
+    script = fake_scheduler.join("qsub.script").read()
+    assert(script.startswith("qarrayrun --shell "))
+    assert(str(array_file_path) in script)
+
+
+def test_max_submits_per_sec(tmpdir, fake_scheduler):
+    """Verify job submissions are spaced to stay under the requested rate.
+    """
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("slurm", max_submits_per_sec=10)
+    start = time.monotonic()
+    for _ in range(3):
+        runner.run("true", "JobName", str(log_file_path))
+    assert(time.monotonic() - start >= 0.2)
+
+
+def _run_slurm_task(fake_scheduler, task_id):
+    """Execute the job script received by the fake sbatch as the given slurm array sub-task."""
+    env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(task_id))
+    return subprocess.check_output(["sh", str(fake_scheduler.join("sbatch.script"))], env=env)
+
+
+def test_pre_substitute_array_run(tmpdir, fake_scheduler):
+    """Verify pre-substituted sub-tasks extract and run their own command.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("a b\nc d\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("slurm")
+    runner.run_array("echo {2} {1}", "JobName", str(log_file_path), str(array_file_path), pre_substitute=True)
+    assert("qarrayrun" not in fake_scheduler.join("sbatch.script").read())
+    assert(_run_slurm_task(fake_scheduler, 2) == b"d c\n")
+
+
+def test_chunk_size_array_run(tmpdir, fake_scheduler):
+    """Verify each sub-task of a chunked array job runs its own lines of the array file.
+    """
+    array_file_path = tmpdir.join("array_file")
+    array_file_path.write("1\n2\n3\n4\n5\n")
+    log_file_path = tmpdir.join("logfile.log")
+
+    runner = JobRunner("slurm")
+    runner.run_array("echo line {1}", "JobName", str(log_file_path), str(array_file_path), chunk_size=2, pre_substitute=True)
+    assert("--array=1-3" in fake_scheduler.join("sbatch.args").read().splitlines())
+    assert(_run_slurm_task(fake_scheduler, 2) == b"line 3\nline 4\n")
+    assert(_run_slurm_task(fake_scheduler, 3) == b"line 5\n")